@@ -1,10 +1,63 @@
 import streamlit as st
 from src.canvas_api import CanvasAPI
 from src.data_processor import DiscussionDataProcessor
-from src.grading_service import GradingService
+from src.grade_cache import GradeCache
+from src.grade_journal import GradeJournal
+from src.text_preprocessor import MessagePreprocessor
+from src.telemetry import Telemetry
 from src.config import *
+from concurrent.futures import ThreadPoolExecutor, wait
+import io
 import os
-import requests
+import time
+import pandas as pd
+
+# Grading, gradebook and dedup modules (and the openai client behind them) are
+# imported where they are first used, so the first page renders without them
+
+@st.cache_resource(show_spinner=False)
+def load_image(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+@st.cache_resource(show_spinner=False)
+def get_canvas_api(canvas_api_key: str) -> CanvasAPI:
+    """One CanvasAPI (connection pool and response cache) per key, shared by reruns and sessions"""
+    return CanvasAPI(CANVAS_BASE_URL, canvas_api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_grade_cache() -> GradeCache:
+    return GradeCache()
+
+@st.cache_resource(show_spinner=False)
+def get_model_router(openai_api_key: str, model: str = DEFAULT_MODEL, base_url: str = None,
+                     fast_model: str = None, route_threshold: int = ROUTING_TOKEN_THRESHOLD,
+                     escalate: bool = ESCALATE_ON_PARSE_FAILURE):
+    """One ModelRouter (and OpenAI connection pool) per key and model configuration"""
+    from src.model_backend import ModelBackend, ModelRouter
+    return ModelRouter(ModelBackend(model, openai_api_key, base_url),
+                       ModelBackend(fast_model, openai_api_key, base_url) if fast_model else None,
+                       token_threshold=route_threshold, escalate=escalate)
+
+def create_grading_service(openai_api_key: str, telemetry: Telemetry, **model_settings):
+    """A GradingService for this session: its run stats and telemetry are its own,
+    while the model clients and grade cache are shared by every session"""
+    from src.grading_service import GradingService
+    return GradingService(openai_api_key, model_settings.get('model', DEFAULT_MODEL), DEFAULT_TEMPERATURE,
+                          cache=get_grade_cache(), telemetry=telemetry,
+                          router=get_model_router(openai_api_key, **model_settings))
+
+@st.cache_resource(show_spinner=False)
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=CANVAS_MAX_WORKERS, thread_name_prefix="canvas-prefetch")
+
+@st.cache_data(ttl=CANVAS_CACHE_TTL, show_spinner=False)
+def load_courses(canvas_api_key: str) -> list:
+    return get_canvas_api(canvas_api_key).get_courses()
+
+@st.cache_data(ttl=CANVAS_CACHE_TTL, show_spinner=False)
+def load_topics(canvas_api_key: str, course_id: int) -> list:
+    return get_canvas_api(canvas_api_key).get_discussion_topics(course_id)
 
 def main():
     # Layout setup
@@ -12,7 +65,7 @@ def main():
     
     # Add UC logo on left
     with col1:
-        st.image("uc_logo.png", width=100)
+        st.image(load_image("uc_logo.png"), width=100)
     
     # Add title and author in middle
     with col2:
@@ -21,7 +74,7 @@ def main():
     
     # Add Lindner logo on right
     with col3:
-        st.image("lindner_logo.png", width=100)
+        st.image(load_image("lindner_logo.png"), width=100)
     
     # Debug Mode Toggle - Moved to top level
     debug_mode = st.checkbox("Debug Mode")
@@ -48,28 +101,52 @@ def main():
     with col2:
         openai_api_key = st.text_input("OpenAI API Key", value=default_openai_key, type="password")
     
+    with st.expander("Model Settings"):
+        col1, col2 = st.columns(2)
+        with col1:
+            model = st.text_input("Model", value=DEFAULT_MODEL)
+            fast_model = st.text_input("Fast model for short posts (optional)", value=FAST_MODEL or "")
+            escalate = st.checkbox("Re-ask the main model when the fast model's answer cannot be parsed",
+                                   value=ESCALATE_ON_PARSE_FAILURE)
+        with col2:
+            base_url = st.text_input("API base URL (optional)",
+                                     help="OpenAI-compatible server, e.g. http://localhost:8080/v1 "
+                                          "for a local llama.cpp or vLLM server")
+            route_threshold = st.number_input("Fast model token limit", min_value=1,
+                                              value=ROUTING_TOKEN_THRESHOLD)
+    
     # Initialize APIs with user-provided keys
     if st.button("Initialize APIs"):
-        initialize_apis(canvas_api_key, openai_api_key)
+        initialize_apis(canvas_api_key, openai_api_key,
+                        {'model': model, 'base_url': base_url or None, 'fast_model': fast_model or None,
+                         'route_threshold': int(route_threshold), 'escalate': escalate})
     
     if st.session_state.api_initialized:
         run_grading_workflow(debug_mode)
     else:
         st.info("Please enter your API keys and click 'Initialize APIs' to continue.")
 
-def initialize_apis(canvas_api_key, openai_api_key):
+def initialize_apis(canvas_api_key, openai_api_key, model_settings=None):
     """Initialize API services from user-provided keys"""
+    model_settings = model_settings or {}
     try:
-        if canvas_api_key and openai_api_key:
-            st.session_state.canvas_api = CanvasAPI(CANVAS_BASE_URL, canvas_api_key)
-            st.session_state.grading_service = GradingService(
-                openai_api_key, DEFAULT_MODEL, DEFAULT_TEMPERATURE)
+        # A local model server (custom base URL) needs no OpenAI key
+        local_model = bool(model_settings.get('base_url'))
+        if canvas_api_key and (openai_api_key or local_model):
+            # Telemetry and run stats belong to this session; connection pools and caches are shared
+            telemetry = st.session_state.setdefault('telemetry', Telemetry())
+            st.session_state.canvas_api = get_canvas_api(canvas_api_key).with_telemetry(telemetry)
+            st.session_state.canvas_api_key = canvas_api_key
+            st.session_state.preprocessor = MessagePreprocessor()
+            st.session_state.grading_service = create_grading_service(openai_api_key, telemetry,
+                                                                      **model_settings)
+            st.session_state.prefetch = {}
             st.session_state.api_initialized = True
             st.success("APIs initialized successfully!")
         else:
             if not canvas_api_key:
                 st.warning("Canvas API key is required.")
-            if not openai_api_key:
+            if not openai_api_key and not local_model:
                 st.warning("OpenAI API key is required.")
     except Exception as e:
         st.error(f"Error initializing APIs: {e}")
@@ -92,11 +169,11 @@ def run_grading_workflow(debug_mode: bool):
         
         if direct_url:
             try:
-                params = {"access_token": st.session_state.canvas_api.api_key}
-                response = requests.get(direct_url, params=params)
+                response = st.session_state.canvas_api.session.get(direct_url)
                 data = response.json()
                 if data:
                     df_participants, df_posts = DiscussionDataProcessor.process_discussion_data(data)
+                    df_posts = prepare_posts(df_posts)
                     if st.session_state.post_limit > 0:
                         df_posts = df_posts.head(st.session_state.post_limit)
                     show_grading_options(df_participants, df_posts, "debug")
@@ -104,65 +181,103 @@ def run_grading_workflow(debug_mode: bool):
                 st.error(f"Error processing URL: {e}")
         return
 
-    # Regular workflow
-    # Initialize session states for tracking button clicks if not already present
-    if 'fetch_courses_clicked' not in st.session_state:
-        st.session_state.fetch_courses_clicked = False
+    # Course and topic lists load as soon as the APIs are ready and are cached across reruns
+    canvas_api = st.session_state.canvas_api
+    canvas_api_key = st.session_state.canvas_api_key
+    if st.button("Refresh Courses and Topics"):
+        load_courses.clear()
+        load_topics.clear()
+        canvas_api.get_courses(use_cache=False)
+        st.session_state.refresh_topics = True
+        st.session_state.prefetch = {}
+        st.session_state.assignment_ids = {}
     
-    if st.button("Fetch Courses"):
-        st.session_state.fetch_courses_clicked = True
-        try:
-            courses = st.session_state.canvas_api.get_courses()
-            if courses:
-                st.session_state.courses = courses
-                st.success(f"Found {len(courses)} courses")
-            else:
-                st.warning("No courses found. Please check your Canvas API key and permissions.")
-        except Exception as e:
-            st.error(f"Error fetching courses: {e}")
+    try:
+        courses = load_courses(canvas_api_key)
+    except Exception as e:
+        st.error(f"Error fetching courses: {e}")
+        return
+    if not courses:
+        st.warning("No courses found. Please check your Canvas API key and permissions.")
+        return
     
-    if 'courses' in st.session_state and st.session_state.courses:
-        course_options = {course[1]: course[0] for course in st.session_state.courses}
-        selected_course = st.selectbox("Select Course", options=list(course_options.keys()))
-        course_id = course_options[selected_course]
-        
-        if 'fetch_topics_clicked' not in st.session_state:
-            st.session_state.fetch_topics_clicked = False
-        
-        if st.button("Fetch Discussion Topics"):
-            st.session_state.fetch_topics_clicked = True
-            try:
-                topics = st.session_state.canvas_api.get_discussion_topics(course_id)
-                if topics:
-                    st.session_state.topics = topics
-                    st.success(f"Found {len(topics)} discussion topics")
-                else:
-                    st.warning("No discussion topics found for this course.")
-            except Exception as e:
-                st.error(f"Error fetching discussion topics: {e}")
-        
-        if 'topics' in st.session_state and st.session_state.topics:
-            topic_options = {topic[1]: topic[0] for topic in st.session_state.topics}
-            selected_topic = st.selectbox("Select Discussion Topic", options=list(topic_options.keys()))
-            topic_id = topic_options[selected_topic]
-            
-            try:
-                data = st.session_state.canvas_api.get_discussion_data(course_id, topic_id)
-                if data:
-                    df_participants, df_posts = DiscussionDataProcessor.process_discussion_data(data)
-                    show_grading_options(df_participants, df_posts, f"{course_id}_{topic_id}")
-                else:
-                    st.warning("No data found for this discussion topic.")
-            except Exception as e:
-                st.error(f"Error fetching discussion data: {e}")
+    course_options = {course[1]: course[0] for course in courses}
+    selected_course = st.selectbox("Select Course", options=list(course_options.keys()))
+    course_id = course_options[selected_course]
+    
+    try:
+        if st.session_state.pop('refresh_topics', False):
+            canvas_api.get_discussion_topics(course_id, use_cache=False)
+        topics = load_topics(canvas_api_key, course_id)
+    except Exception as e:
+        st.error(f"Error fetching discussion topics: {e}")
+        return
+    if not topics:
+        st.warning("No discussion topics found for this course.")
+        return
+    
+    prefetched = prefetch_discussions(canvas_api, course_id, topics)
+    topic_options = {topic[1]: topic[0] for topic in topics}
+    selected_topic = st.selectbox("Select Discussion Topic", options=list(topic_options.keys()))
+    topic_id = topic_options[selected_topic]
+    
+    # Payloads are cached (and revalidated with ETags) by CanvasAPI and parsed
+    # DataFrames are memoized by payload hash, so reruns from widget changes are cheap
+    refresh = st.button("Refresh Discussion Data")
+    future = prefetched.get(topic_id)
+    # A download still queued behind other topics is dropped and the topic fetched now;
+    # one already running is left to finish rather than fetching the topic twice
+    if future is not None and not future.cancel() and not refresh:
+        wait([future])
+    try:
+        data, payload_hash = canvas_api.get_discussion_data_with_hash(
+            course_id, topic_id, use_cache=not refresh)
+        if data:
+            df_participants, df_posts = DiscussionDataProcessor.process_discussion_data_cached(
+                data, payload_hash)
+            df_posts = prepare_posts(df_posts)
+            show_grading_options(df_participants, df_posts, f"{course_id}_{topic_id}")
+        else:
+            st.warning("No data found for this discussion topic.")
+    except Exception as e:
+        st.error(f"Error fetching discussion data: {e}")
+
+def _prefetch_topic(canvas_api, course_id: int, topic_id: int, parse: bool):
+    data, payload_hash = canvas_api.get_discussion_data_with_hash(course_id, topic_id)
+    if data and parse:
+        DiscussionDataProcessor.process_discussion_data_cached(data, payload_hash)
+
+def prefetch_discussions(canvas_api, course_id: int, topics) -> dict:
+    """Download every topic of the course in the background so switching topics is instant.
+
+    Returns {topic_id: Future}. Topics are also parsed when they all fit in the
+    parsed-data memo; otherwise later topics would only evict earlier ones.
+    """
+    prefetch = st.session_state.setdefault('prefetch', {})
+    if course_id not in prefetch:
+        executor = get_prefetch_executor()
+        parse = len(topics) <= PARSED_DATA_CACHE_SIZE
+        prefetch[course_id] = {topic_id: executor.submit(_prefetch_topic, canvas_api, course_id, topic_id, parse)
+                               for topic_id, _ in topics}
+    futures = prefetch[course_id]
+    ready = sum(future.done() for future in futures.values())
+    if ready < len(futures):
+        st.caption(f"Loading discussions in the background: {ready}/{len(futures)} ready")
+    return futures
+
+def prepare_posts(df_posts):
+    """Clean message HTML and enforce the token budget before grading (memoized per message)"""
+    preprocessor = st.session_state.preprocessor
+    preprocessor.reset_stats()
+    return preprocessor.preprocess_dataframe(df_posts)
 
 def show_grading_options(df_participants, df_posts, identifier):
-    if 'current_data' not in st.session_state:
-        st.session_state.current_data = {
-            'df_participants': df_participants,
-            'df_posts': df_posts,
-            'identifier': identifier
-        }
+    # Replaced on every rerun so grading always uses the topic currently selected
+    st.session_state.current_data = {
+        'df_participants': df_participants,
+        'df_posts': df_posts,
+        'identifier': identifier
+    }
     
     # Store values in session state if not already present
     if 'post_points' not in st.session_state:
@@ -170,7 +285,7 @@ def show_grading_options(df_participants, df_posts, identifier):
     if 'reply_points' not in st.session_state:
         st.session_state.reply_points = DEFAULT_REPLY_POINTS
     if 'system_prompt' not in st.session_state:
-        st.session_state.system_prompt = "You are a teaching assistant grading discussion board posts. Grade based on quality, relevance, and critical thinking."
+        st.session_state.system_prompt = DEFAULT_SYSTEM_PROMPT
 
     st.subheader("Grading Configuration")
     col1, col2 = st.columns(2)
@@ -194,6 +309,38 @@ def show_grading_options(df_participants, df_posts, identifier):
         key="system_prompt_input"
     )
     
+    max_workers = st.number_input(
+        "Concurrent Grading Requests",
+        min_value=1,
+        max_value=64,
+        value=MAX_CONCURRENT_REQUESTS,
+        key="max_workers_input"
+    )
+    
+    packed = st.checkbox(
+        "Pack short posts into shared grading requests",
+        value=False,
+        key="packed_input",
+        help="Grades several short posts per model call, cutting request count on reply-heavy topics"
+    )
+    
+    dedup = st.checkbox(
+        "Grade duplicate posts once",
+        value=False,
+        key="dedup_input",
+        help="Groups identical and near-identical posts, grades one per group and gives the rest "
+             "the same grade. Groups written by different students are flagged for review."
+    )
+    
+    grading_service = st.session_state.grading_service
+    if st.button("Clear Cached Grades for These Instructions"):
+        removed = grading_service.cache.invalidate_rubric(system_prompt) if grading_service.cache else 0
+        # Journaled grades would otherwise be resumed instead of regraded
+        settings = GradeJournal.settings_key(post_points, reply_points, system_prompt,
+                                             grading_service.model_label, grading_service.temperature)
+        unjournaled = GradeJournal(identifier).discard(settings)
+        st.info(f"Removed {removed} cached grades and {unjournaled} journaled grades for this topic")
+    
     if st.button("Grade Posts", key="grade_button"):
         process_grading(
             st.session_state.current_data['df_participants'],
@@ -201,10 +348,21 @@ def show_grading_options(df_participants, df_posts, identifier):
             post_points,
             reply_points,
             system_prompt,
-            st.session_state.current_data['identifier']
+            st.session_state.current_data['identifier'],
+            max_workers,
+            packed,
+            dedup
         )
+    
+    # Grades and totals stay available across reruns so caps can be changed without regrading
+    graded = st.session_state.get('graded_results')
+    if graded is not None and graded['identifier'] == identifier:
+        show_gradebook(graded['df_posts'], identifier, graded['post_points'], graded['reply_points'])
+        if identifier != "debug":
+            show_grade_push(graded['df_posts'], identifier)
 
-def process_grading(df_participants, df_posts, post_points, reply_points, system_prompt, identifier):
+def process_grading(df_participants, df_posts, post_points, reply_points, system_prompt, identifier,
+                    max_workers=MAX_CONCURRENT_REQUESTS, packed=False, dedup=False):
     # Create a status container to show detailed progress
     status_container = st.container()
     with status_container:
@@ -219,70 +377,96 @@ def process_grading(df_participants, df_posts, post_points, reply_points, system
         status_container.error("No posts found to grade!")
         return
     
-    # Create a copy of the dataframe to avoid modifying the original during iteration
-    graded_posts = df_posts.copy()
-    
-    # Set up columns for grades and feedback if they don't exist
-    if 'grade_numeric' not in graded_posts.columns:
-        graded_posts['grade_numeric'] = None
-    if 'grade_feedback' not in graded_posts.columns:
-        graded_posts['grade_feedback'] = None
-    
     # Track if any grading was successful
     grading_success = False
     
+    # Duplicate columns are kept in the export as a consistency and plagiarism signal
+    if dedup:
+        from src.dedup import DuplicateDetector
+        df_posts = DuplicateDetector().annotate(df_posts)
+    
     # Apply post limit if in debug mode
+    graded_posts = df_posts
     if 'post_limit' in st.session_state and st.session_state.post_limit > 0:
         graded_posts = graded_posts.head(st.session_state.post_limit)
     
+    # Every grade is journaled to disk as it arrives, so a refresh or crash only
+    # loses the requests in flight; posts journaled by an earlier run are skipped
+    grading_service = st.session_state.grading_service
+    journal = GradeJournal(identifier)
+    settings = GradeJournal.settings_key(post_points, reply_points, system_prompt,
+                                         grading_service.model_label, grading_service.temperature)
+    
     try:
         # Display DataFrame columns for debugging
         error_text.text(f"DataFrame columns: {list(graded_posts.columns)}")
         
-        for idx, row in graded_posts.iterrows():
-            progress = (idx + 1) / len(graded_posts)
-            progress_bar.progress(progress)
-            status_text.text(f"Grading post {idx + 1}/{len(graded_posts)}")
+        stats = st.session_state.preprocessor.summary()
+        if stats['original_tokens']:
+            st.write(f"Preprocessing cut message tokens from {stats['original_tokens']:,} to "
+                     f"{stats['cleaned_tokens']:,} ({stats['percent_saved']:.0f}% saved, "
+                     f"{stats['truncated']} long posts truncated)")
+        
+        to_grade = journal.pending(graded_posts, settings)
+        resumed_count = len(graded_posts) - len(to_grade)
+        if resumed_count:
+            status_text.text(f"{resumed_count} posts were already graded in an earlier run")
+        
+        from src.grading_engine import GradingEngine
+        engine = GradingEngine(grading_service, max_workers=max_workers, packed=packed)
+        run_started = time.time()
+        grading_service.reset_stats()
+        total = len(to_grade)
+        completed = 0
+        cached_count = 0
+        deduplicated_count = 0
+        
+        # Results arrive in completion order and are journaled by post_id
+        for result in engine.grade_posts(to_grade, post_points, reply_points, system_prompt):
+            completed += 1
+            progress_bar.progress(completed / total)
+            status_text.text(f"Graded {completed}/{total} posts")
             
-            try:
-                # Debug info
-                error_text.text(f"Processing post type: {row['type']}, length: {len(row['message'])}")
-                
-                # Call the grading service
-                grade, feedback = st.session_state.grading_service.grade_discussion(
-                    row['message'],
-                    row['type'],
-                    post_points,
-                    reply_points,
-                    system_prompt
-                )
-                
-                # Update the dataframe with results
-                graded_posts.at[idx, 'grade_numeric'] = grade
-                graded_posts.at[idx, 'grade_feedback'] = feedback
-                grading_success = True
-                
-                # Show current grading result
-                error_text.text(f"Graded post {idx + 1}: Score = {grade}")
-                
-            except Exception as e:
-                error_text.error(f"Error grading post {idx + 1}: {str(e)}")
-                # Continue with next post instead of breaking
+            if result.error is not None:
+                error_text.error(f"Error grading post {result.index + 1}: {result.error}")
                 continue
+            
+            row = to_grade.loc[result.index]
+            journal.append(row['post_id'], row.get('updated_at'), settings, result.grade, result.feedback)
+            if result.deduplicated:
+                deduplicated_count += 1
+            elif result.cached:
+                cached_count += 1
+            
+            # Show current grading result
+            error_text.text(f"Graded post {result.index + 1}: Score = {result.grade}")
+        
+        if total == 0:
+            progress_bar.progress(1.0)
         
-        # Update the original dataframe with graded results
-        for idx in graded_posts.index:
-            if idx in df_posts.index:
-                df_posts.at[idx, 'grade_numeric'] = graded_posts.at[idx, 'grade_numeric']
-                df_posts.at[idx, 'grade_feedback'] = graded_posts.at[idx, 'grade_feedback']
+        # Assemble the export from the journal rather than from in-memory results
+        df_posts = journal.apply(df_posts, settings)
+        grading_success = df_posts['grade_numeric'].notna().any()
         
         if grading_success:
             # Save the results
             os.makedirs(OUTPUT_DIR, exist_ok=True)
             output_file = f"{OUTPUT_DIR}/graded_discussion_{identifier}.csv"
             df_posts.to_csv(output_file, index=False)
+            st.session_state.graded_results = {'identifier': identifier, 'df_posts': df_posts,
+                                               'post_points': post_points, 'reply_points': reply_points}
             
-            status_container.success("Grading completed!")
+            status_container.success(
+                f"Grading completed! {resumed_count} posts resumed from the journal, "
+                f"{cached_count} unchanged posts reused cached grades, "
+                f"{deduplicated_count} duplicates reused their group's grade, "
+                f"{total - cached_count - deduplicated_count} sent for grading.")
+            parsing = grading_service.parse_report()
+            if parsing['unparsed']:
+                st.warning(
+                    f"{parsing['parse_failure_rate']:.1%} of model answers had no readable grade; "
+                    f"{parsing['reasks']} were re-asked and {parsing['parse_failures']} posts are left "
+                    f"ungraded. Grade again to retry only those posts.")
             st.download_button(
                 "Download Graded Results",
                 df_posts.to_csv(index=False),
@@ -314,8 +498,18 @@ def process_grading(df_participants, df_posts, post_points, reply_points, system
                 st.dataframe(df_posts.head(10))
             else:
                 st.dataframe(df_posts[display_columns].head(10))
+            
+            if dedup and df_posts['flag_review'].any():
+                flagged = df_posts[df_posts['flag_review']]
+                st.warning(f"{flagged['duplicate_cluster'].nunique()} groups of near-identical posts were "
+                           f"written by different students and should be reviewed.")
+                review_columns = [c for c in ['duplicate_cluster', 'user_id', 'display_name', 'type',
+                                              'similarity', 'message'] if c in flagged.columns]
+                st.dataframe(flagged.sort_values('duplicate_cluster')[review_columns])
         else:
             status_container.warning("No posts were successfully graded. Check the errors above.")
+        
+        show_telemetry(run_started, identifier)
             
     except Exception as e:
         status_container.error(f"Critical error in grading process: {str(e)}")
@@ -323,5 +517,108 @@ def process_grading(df_participants, df_posts, post_points, reply_points, system
         import traceback
         error_text.code(traceback.format_exc())
 
+def show_gradebook(df_posts, identifier: str, post_points: float, reply_points: float):
+    """Show per-student totals with Canvas gradebook CSV and Parquet downloads"""
+    from src.gradebook import Gradebook
+    st.subheader("Student Totals")
+    col1, col2 = st.columns(2)
+    with col1:
+        max_posts = st.number_input("Posts counted per student", min_value=0,
+                                    value=GRADEBOOK_MAX_POSTS, key=f"max_posts_{identifier}")
+    with col2:
+        max_replies = st.number_input("Replies counted per student", min_value=0,
+                                      value=GRADEBOOK_MAX_REPLIES, key=f"max_replies_{identifier}")
+    
+    gradebook = Gradebook.aggregate(df_posts, max_posts, max_replies)
+    st.dataframe(gradebook)
+    
+    points_possible = post_points * max_posts + reply_points * max_replies
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download Canvas Gradebook CSV",
+                           Gradebook.to_canvas_csv(gradebook, points_possible=points_possible),
+                           file_name=f"gradebook_{identifier}.csv", mime="text/csv")
+    with col2:
+        try:
+            buffer = io.BytesIO()
+            Gradebook.to_parquet(gradebook, buffer)
+            st.download_button("Download Parquet", buffer.getvalue(),
+                               file_name=f"gradebook_{identifier}.parquet",
+                               mime="application/octet-stream")
+        except ImportError:
+            st.caption("Install pyarrow to enable Parquet export.")
+
+def show_grade_push(df_posts, identifier: str):
+    """Diff per-student totals against the Canvas gradebook and push only the changed scores"""
+    from src.gradebook import Gradebook
+    from src.grade_push import GradePush
+    st.subheader("Push Grades to Canvas")
+    course_id, topic_id = (int(part) for part in identifier.split("_"))
+    canvas_api = st.session_state.canvas_api
+    # Looked up once per topic; this section re-renders on every widget change
+    assignment_ids = st.session_state.setdefault('assignment_ids', {})
+    if identifier not in assignment_ids:
+        assignment_ids[identifier] = canvas_api.get_topic_assignment_id(course_id, topic_id)
+    assignment_id = assignment_ids[identifier]
+    if assignment_id is None:
+        st.info("This discussion is not a graded assignment in Canvas, so there is nothing to push to.")
+        return
+    
+    max_posts = st.session_state.get(f"max_posts_{identifier}", GRADEBOOK_MAX_POSTS)
+    max_replies = st.session_state.get(f"max_replies_{identifier}", GRADEBOOK_MAX_REPLIES)
+    include_comments = st.checkbox("Include feedback comments", value=True, key=f"push_comments_{identifier}")
+    pusher = GradePush(canvas_api)
+    
+    if st.button("Preview Changes", key=f"push_preview_{identifier}"):
+        try:
+            scores = Gradebook.aggregate(df_posts, max_posts, max_replies)
+            comments = GradePush.build_comments(df_posts) if include_comments else None
+            st.session_state.push_plan = {'identifier': identifier,
+                                          'plan': pusher.plan(course_id, assignment_id, scores, comments)}
+        except Exception as e:
+            st.error(f"Error reading the Canvas gradebook: {e}")
+    
+    pending = st.session_state.get('push_plan')
+    if pending is None or pending['identifier'] != identifier:
+        return
+    plan = pending['plan']
+    summary = pusher.push(course_id, assignment_id, plan, dry_run=True)
+    st.write(f"{summary['changed']} of {summary['students']} scores differ from the Canvas gradebook")
+    st.dataframe(plan[plan['changed']][['user_id', 'display_name', 'current_score', 'new_score']])
+    
+    if summary['changed'] and st.button("Push Changed Grades", key=f"push_send_{identifier}"):
+        with st.spinner(f"Sending {summary['changed']} grades to Canvas..."):
+            summary = pusher.push(course_id, assignment_id, plan)
+        del st.session_state.push_plan
+        if summary['failed']:
+            st.error(f"Sent {summary['sent']} grades; {summary['failed']} could not be updated.")
+        else:
+            st.success(f"Sent {summary['sent']} grades to Canvas.")
+
+def show_telemetry(since: float, identifier: str):
+    """Show latency, token and cost statistics for the calls made since `since`"""
+    telemetry = st.session_state.telemetry
+    summary = telemetry.summary(since)
+    if not summary:
+        return
+    
+    st.subheader("Grading Telemetry")
+    model_stats = summary.get('model')
+    if model_stats:
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Model calls", model_stats['calls'])
+        col2.metric("p95 latency", f"{model_stats['p95_latency']:.2f}s")
+        col3.metric("Tokens", f"{model_stats['prompt_tokens'] + model_stats['completion_tokens']:,}")
+        col4.metric("Estimated cost", f"${model_stats['cost']:.4f}")
+    st.dataframe(pd.DataFrame(summary).T)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download Telemetry (JSON)", telemetry.to_json(since),
+                           file_name=f"telemetry_{identifier}.json", mime="application/json")
+    with col2:
+        st.download_button("Download Telemetry (CSV)", telemetry.to_csv(since),
+                           file_name=f"telemetry_{identifier}.csv", mime="text/csv")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
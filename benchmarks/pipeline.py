@@ -0,0 +1,182 @@
+"""Offline throughput benchmark of the fetch -> process -> grade -> export pipeline.
+
+Runs CanvasAPI, DiscussionDataProcessor, MessagePreprocessor and GradingEngine
+end to end against the local fake Canvas and OpenAI servers, so no API keys
+are needed:
+
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --courses 2 --posts 200 --depth 3 --message-words 300
+    python -m benchmarks.pipeline --latency 0.2 --error-rate 0.02 --rate-limit-rate 0.05 --json result.json
+
+Reports per-stage wall time, posts/sec, peak RSS and request counts on both fakes.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from fakes.fake_canvas import FakeCanvasServer, generate_courses
+from fakes.fake_openai import FakeOpenAIServer
+from src.canvas_api import CanvasAPI
+from src.data_processor import DiscussionDataProcessor
+from src.dedup import DuplicateDetector
+from src.grading_service import GradingService
+from src.grading_engine import GradingEngine
+from src.response_cache import ResponseCache
+from src.telemetry import Telemetry
+from src.text_preprocessor import MessagePreprocessor
+from src.config import DEFAULT_SYSTEM_PROMPT, DEFAULT_POST_POINTS, DEFAULT_REPLY_POINTS
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the grading pipeline against local fakes")
+    group = parser.add_argument_group("fake Canvas")
+    group.add_argument("--courses", type=int, default=1)
+    group.add_argument("--topics", type=int, default=4, help="Topics per course")
+    group.add_argument("--posts", type=int, default=50, help="Top-level posts per topic")
+    group.add_argument("--replies", type=int, default=2, help="Direct replies per post")
+    group.add_argument("--depth", type=int, default=1, help="Nesting depth of each reply chain")
+    group.add_argument("--message-words", type=int, default=60, help="Extra words per message")
+    group.add_argument("--page-size", type=int, default=None, help="Cap on per_page for list endpoints")
+    group.add_argument("--canvas-rate-cost", type=float, default=0.0,
+                       help="Rate-limit units charged per Canvas request (bucket of 700)")
+    group = parser.add_argument_group("fake OpenAI")
+    group.add_argument("--latency", type=float, default=0.0, help="Seconds per chat completion")
+    group.add_argument("--latency-jitter", type=float, default=0.0)
+    group.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with 500")
+    group.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls failing with 429")
+    group.add_argument("--malformed-rate", type=float, default=0.0,
+                       help="Fraction of answers that contain no grade")
+    group = parser.add_argument_group("pipeline")
+    group.add_argument("--workers", type=int, default=8, help="Concurrent grading requests")
+    group.add_argument("--canvas-workers", type=int, default=8)
+    group.add_argument("--packed", action="store_true")
+    group.add_argument("--dedup", action="store_true", help="Grade near-duplicate posts once")
+    group.add_argument("--no-stream", action="store_true", help="Load /view payloads whole instead of streaming")
+    group.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run(args: argparse.Namespace) -> Dict:
+    courses = generate_courses(args.courses, args.topics, args.posts, args.replies, args.seed,
+                               thread_depth=args.depth, message_words=args.message_words)
+    canvas = FakeCanvasServer(courses, max_per_page=args.page_size, rate_limit_cost=args.canvas_rate_cost)
+    openai_fake = FakeOpenAIServer(latency=args.latency, latency_jitter=args.latency_jitter,
+                                   error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                   malformed_rate=args.malformed_rate, seed=args.seed)
+    telemetry = Telemetry()
+    canvas_api = CanvasAPI(canvas.start(), "fake-token", max_workers=args.canvas_workers,
+                           cache=ResponseCache(ttl=0), telemetry=telemetry)
+    # No grade cache and no rate limiter, so every post exercises the request path
+    grading_service = GradingService("fake-key", "gpt-4o", 0.5, base_url=openai_fake.start(),
+                                     telemetry=telemetry)
+    engine = GradingEngine(grading_service, max_workers=args.workers, requests_per_minute=None,
+                           tokens_per_minute=None, packed=args.packed)
+    preprocessor = MessagePreprocessor()
+    stages = {}
+
+    try:
+        start = time.perf_counter()
+        topics = [(course_id, topic_id)
+                  for course_id, _ in canvas_api.get_courses(use_cache=False)
+                  for topic_id, _ in canvas_api.get_discussion_topics(course_id, use_cache=False)]
+        frames = {}
+        for course_id, topic_id in topics:
+            if args.no_stream:
+                data = canvas_api.get_discussion_data(course_id, topic_id, use_cache=False)
+                _, df_posts = DiscussionDataProcessor.process_discussion_data(data)
+            else:
+                items = canvas_api.stream_discussion_data(course_id, topic_id)
+                _, df_posts = DiscussionDataProcessor.process_discussion_stream(items)
+            frames[(course_id, topic_id)] = df_posts
+        stages['fetch_and_process'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frames = {key: preprocessor.preprocess_dataframe(df) for key, df in frames.items()}
+        stages['preprocess'] = time.perf_counter() - start
+
+        if args.dedup:
+            start = time.perf_counter()
+            detector = DuplicateDetector()
+            frames = {key: detector.annotate(df) for key, df in frames.items()}
+            stages['dedup'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        graded, failed = {}, 0
+        for key, df_posts in frames.items():
+            df_graded = engine.grade_dataframe(df_posts, DEFAULT_POST_POINTS, DEFAULT_REPLY_POINTS,
+                                               DEFAULT_SYSTEM_PROMPT)
+            failed += int(df_graded['grade_numeric'].isna().sum())
+            graded[key] = df_graded
+        stages['grade'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as output_dir:
+            for (course_id, topic_id), df_graded in graded.items():
+                df_graded.to_csv(os.path.join(output_dir, f"graded_discussion_{course_id}_{topic_id}.csv"),
+                                 index=False)
+        stages['export'] = time.perf_counter() - start
+    finally:
+        canvas_api.close()
+        canvas.stop()
+        openai_fake.stop()
+
+    posts = sum(len(df) for df in frames.values())
+    total = sum(stages.values())
+    model = telemetry.summary().get('model', {})
+    parsing = grading_service.parse_report()
+    return {
+        'topics': len(frames),
+        'posts': posts,
+        'failed_posts': failed,
+        'stage_seconds': stages,
+        'total_seconds': total,
+        'posts_per_sec': posts / total if total else 0.0,
+        'grading_posts_per_sec': posts / stages['grade'] if stages['grade'] else 0.0,
+        'model_p95_latency': model.get('p95_latency', 0.0),
+        'model_retries': model.get('retries', 0),
+        'parse_failure_rate': parsing['parse_failure_rate'],
+        'parse_reasks': parsing['reasks'],
+        'peak_rss_mb': peak_rss_mb(),
+        'canvas_requests': dict(canvas.request_counts),
+        'openai_requests': dict(openai_fake.request_counts)
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = run(args)
+    print(f"{results['topics']} topics, {results['posts']} posts ({results['failed_posts']} failed)")
+    for stage, seconds in results['stage_seconds'].items():
+        print(f"  {stage:<18} {seconds:8.3f}s")
+    print(f"  {'total':<18} {results['total_seconds']:8.3f}s")
+    print(f"Throughput: {results['posts_per_sec']:.1f} posts/sec overall, "
+          f"{results['grading_posts_per_sec']:.1f} posts/sec grading")
+    print(f"Model p95 latency {results['model_p95_latency']:.3f}s, {results['model_retries']} retries")
+    print(f"Unparseable answers: {results['parse_failure_rate']:.1%}, {results['parse_reasks']} re-asks")
+    print(f"Peak RSS: {results['peak_rss_mb']:.1f} MB")
+    print(f"Canvas requests: {sum(results['canvas_requests'].values())} {results['canvas_requests']}")
+    print(f"OpenAI requests: {sum(results['openai_requests'].values())} {results['openai_requests']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Local fake of the Canvas REST API for exercising CanvasAPI without a real instance.
+
+    server = FakeCanvasServer(generate_courses(num_courses=2, topics_per_course=3))
+    base_url = server.start()
+    api = CanvasAPI(base_url, "fake-token")
+    ...
+    server.stop()
+
+Every topic is a graded discussion whose assignment (id topic_id * 10) accepts
+bulk grade updates, applied asynchronously through Progress objects.
+"""
+import hashlib
+import json
+import random
+import re
+import string
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+def generate_courses(num_courses: int = 1,
+                     topics_per_course: int = 2,
+                     posts_per_topic: int = 20,
+                     replies_per_post: int = 2,
+                     seed: int = 0,
+                     thread_depth: int = 1,
+                     message_words: int = 0) -> Dict[int, Dict]:
+    """Build synthetic courses keyed by id, each with topics holding a /view payload.
+
+    Each post gets replies_per_post direct replies, and each of those starts a chain
+    of nested replies down to thread_depth. message_words > 0 pads every message
+    with that many pseudo-random words.
+    """
+    rng = random.Random(seed)
+    courses = {}
+    entry_id = 1
+    for c in range(num_courses):
+        course_id = 1000 + c
+        participants = [{'id': 5000 + u, 'display_name': f"Student {u}"}
+                        for u in range(max(posts_per_topic, 1))]
+        topics = {}
+        for t in range(topics_per_course):
+            topic_id = course_id * 100 + t
+            view = []
+            for p in range(posts_per_topic):
+                post = _entry(entry_id, rng.choice(participants)['id'], None, _words(rng, message_words))
+                entry_id += 1
+                for _ in range(replies_per_post):
+                    parent = post
+                    for _ in range(max(thread_depth, 1)):
+                        reply = _entry(entry_id, rng.choice(participants)['id'], parent['id'],
+                                       _words(rng, message_words))
+                        parent['replies'].append(reply)
+                        parent = reply
+                        entry_id += 1
+                view.append(post)
+            topics[topic_id] = {
+                'title': f"Discussion {t + 1}",
+                'assignment_id': topic_id * 10,
+                'view': {'participants': participants, 'view': view, 'new_entries': []}
+            }
+        courses[course_id] = {'name': f"Course {c + 1}", 'topics': topics}
+    return courses
+
+
+def _words(rng: random.Random, count: int) -> str:
+    """Random lowercase pseudo-words, so generated messages are distinct rather than near-duplicates"""
+    return " ".join("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+                    for _ in range(count))
+
+
+def _entry(entry_id: int, user_id: int, parent_id: Optional[int], extra: str = "") -> Dict:
+    return {
+        'id': entry_id,
+        'user_id': user_id,
+        'parent_id': parent_id,
+        'created_at': "2024-01-01T12:00:00Z",
+        'updated_at': "2024-01-01T12:00:00Z",
+        'message': f"<p>Discussion entry {entry_id} with some thoughts on the reading.</p>"
+                   + (f"<p>{extra}</p>" if extra else ""),
+        'replies': []
+    }
+
+
+class _FakeCanvasHandler(BaseHTTPRequestHandler):
+    server_version = "FakeCanvas/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        parsed = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        path = parsed.path[len("/api/v1"):] if parsed.path.startswith("/api/v1") else parsed.path
+        fake.record_request(path)
+        if not fake.consume_rate_limit():
+            return self._send_json({'errors': [{'message': "403 Forbidden (Rate Limit Exceeded)"}]}, 403)
+
+        if path == "/courses":
+            items = [{'id': cid, 'name': c['name']} for cid, c in fake.courses.items()]
+            return self._send_page(items, parsed.path, query)
+
+        match = re.fullmatch(r"/courses/(\d+)/discussion_topics", path)
+        if match:
+            course = fake.courses.get(int(match.group(1)))
+            if course is None:
+                return self._send_json({'errors': [{'message': "not found"}]}, 404)
+            items = [{'id': tid, 'title': t['title']} for tid, t in course['topics'].items()]
+            return self._send_page(items, parsed.path, query)
+
+        match = re.fullmatch(r"/courses/(\d+)/discussion_topics/(\d+)", path)
+        if match:
+            topic = fake.courses.get(int(match.group(1)), {}).get('topics', {}).get(int(match.group(2)))
+            if topic is None:
+                return self._send_json({'errors': [{'message': "not found"}]}, 404)
+            return self._send_json({'id': int(match.group(2)), 'title': topic['title'],
+                                    'assignment_id': topic['assignment_id']})
+
+        match = re.fullmatch(r"/courses/(\d+)/assignments/(\d+)/submissions", path)
+        if match:
+            assignment = fake.assignments.get(int(match.group(2)))
+            if assignment is None or assignment['course_id'] != int(match.group(1)):
+                return self._send_json({'errors': [{'message': "not found"}]}, 404)
+            with fake._lock:
+                items = [{'user_id': user_id, 'assignment_id': int(match.group(2)), 'score': score}
+                         for user_id, score in assignment['scores'].items()]
+            return self._send_page(items, parsed.path, query)
+
+        match = re.fullmatch(r"/progress/(\d+)", path)
+        if match:
+            progress = fake.refresh_progress(int(match.group(1)))
+            if progress is None:
+                return self._send_json({'errors': [{'message': "not found"}]}, 404)
+            return self._send_json(progress)
+
+        match = re.fullmatch(r"/courses/(\d+)/discussion_topics/(\d+)/view", path)
+        if match:
+            course = fake.courses.get(int(match.group(1)), {})
+            topic = course.get('topics', {}).get(int(match.group(2)))
+            if topic is None:
+                return self._send_json({'errors': [{'message': "not found"}]}, 404)
+            body = json.dumps(topic['view']).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            return self._send_json(topic['view'], headers={'ETag': etag}, body=body)
+
+        self._send_json({'errors': [{'message': "not found"}]}, 404)
+
+    def do_POST(self):
+        fake = self.server.fake
+        path = urlparse(self.path).path
+        path = path[len("/api/v1"):] if path.startswith("/api/v1") else path
+        fake.record_request(path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        if not fake.consume_rate_limit():
+            return self._send_json({'errors': [{'message': "403 Forbidden (Rate Limit Exceeded)"}]}, 403)
+
+        match = re.fullmatch(r"/courses/(\d+)/assignments/(\d+)/submissions/update_grades", path)
+        if match:
+            assignment_id = int(match.group(2))
+            assignment = fake.assignments.get(assignment_id)
+            if assignment is None or assignment['course_id'] != int(match.group(1)):
+                return self._send_json({'errors': [{'message': "not found"}]}, 404)
+            grade_data: Dict[int, Dict[str, str]] = {}
+            for key, values in parse_qs(body).items():
+                field = re.fullmatch(r"grade_data\[(\d+)\]\[(\w+)\]", key)
+                if field:
+                    grade_data.setdefault(int(field.group(1)), {})[field.group(2)] = values[-1]
+            return self._send_json(fake.create_progress(assignment_id, grade_data))
+
+        self._send_json({'errors': [{'message': "not found"}]}, 404)
+
+    def _send_page(self, items: List, path: str, query: Dict):
+        per_page = int(query.get('per_page', 10))
+        if self.server.fake.max_per_page:
+            per_page = min(per_page, self.server.fake.max_per_page)
+        page = int(query.get('page', 1))
+        start = (page - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            next_query = dict(query, page=page + 1, per_page=per_page)
+            next_url = f"http://{self.headers['Host']}{path}?{urlencode(next_query)}"
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        self._send_json(items[start:start + per_page], headers=headers)
+
+    def _send_json(self, payload, status: int = 200, headers: Optional[Dict] = None,
+                   body: Optional[bytes] = None):
+        if body is None:
+            body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Rate-Limit-Remaining", f"{self.server.fake.rate_limit_remaining:.1f}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeCanvasServer:
+    """Threaded HTTP server serving generated courses under /api/v1.
+
+    Like Canvas, each request costs rate_limit_cost from a 700-unit bucket that
+    refills at rate_limit_refill units per second; requests made while the bucket
+    is empty get 403 Rate Limit Exceeded. max_per_page caps the per_page parameter.
+    """
+    def __init__(self, courses: Dict[int, Dict], host: str = "127.0.0.1", port: int = 0,
+                 max_per_page: Optional[int] = None, rate_limit_cost: float = 0.0,
+                 rate_limit_refill: float = 10.0, progress_delay: float = 0.0,
+                 failed_updates: int = 0):
+        self.courses = courses
+        # Gradebook state per assignment: current scores and comments by user id
+        self.assignments: Dict[int, Dict] = {}
+        for course_id, course in courses.items():
+            for topic_id, topic in course['topics'].items():
+                user_ids = [p['id'] for p in topic['view']['participants']]
+                self.assignments[topic['assignment_id']] = {
+                    'course_id': course_id,
+                    'topic_id': topic_id,
+                    'scores': {user_id: None for user_id in user_ids},
+                    'comments': {user_id: [] for user_id in user_ids}
+                }
+        self.progress: Dict[int, Dict] = {}
+        self.progress_delay = progress_delay
+        # The next failed_updates bulk updates end in a failed Progress, for exercising retries
+        self.failed_updates = failed_updates
+        self.max_per_page = max_per_page
+        self.rate_limit_cost = rate_limit_cost
+        self.rate_limit_refill = rate_limit_refill
+        self.rate_limit_remaining = 700.0
+        self._rate_limit_updated = time.monotonic()
+        self.request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _FakeCanvasHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def record_request(self, path: str):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def create_progress(self, assignment_id: int, grade_data: Dict[int, Dict[str, str]]) -> Dict:
+        with self._lock:
+            progress_id = len(self.progress) + 1
+            fail = self.failed_updates > 0
+            self.failed_updates -= int(fail)
+            self.progress[progress_id] = {
+                'id': progress_id,
+                'context_id': assignment_id,
+                'context_type': "Assignment",
+                'tag': "submissions_update",
+                'workflow_state': "queued",
+                'message': None,
+                'url': f"{self.base_url}/progress/{progress_id}",
+                '_grade_data': grade_data,
+                '_fail': fail,
+                '_created': time.monotonic()
+            }
+        return self.refresh_progress(progress_id)
+
+    def refresh_progress(self, progress_id: int) -> Optional[Dict]:
+        """Apply a queued bulk update once progress_delay has passed"""
+        with self._lock:
+            progress = self.progress.get(progress_id)
+            if progress is None:
+                return None
+            if progress['workflow_state'] in ("queued", "running"):
+                if time.monotonic() - progress['_created'] < self.progress_delay:
+                    progress['workflow_state'] = "running"
+                elif progress['_fail']:
+                    progress['workflow_state'] = "failed"
+                    progress['message'] = "Simulated failure"
+                else:
+                    assignment = self.assignments[progress['context_id']]
+                    for user_id, fields in progress['_grade_data'].items():
+                        if user_id not in assignment['scores']:
+                            continue
+                        if 'posted_grade' in fields:
+                            assignment['scores'][user_id] = float(fields['posted_grade'])
+                        if fields.get('text_comment'):
+                            assignment['comments'][user_id].append(fields['text_comment'])
+                    progress['workflow_state'] = "completed"
+            return {k: v for k, v in progress.items() if not k.startswith('_')}
+
+    def consume_rate_limit(self) -> bool:
+        """Charge one request against the bucket; False when it is exhausted"""
+        with self._lock:
+            now = time.monotonic()
+            self.rate_limit_remaining = min(
+                700.0, self.rate_limit_remaining + (now - self._rate_limit_updated) * self.rate_limit_refill)
+            self._rate_limit_updated = now
+            if self.rate_limit_remaining < self.rate_limit_cost:
+                self.request_counts['rate_limited'] = self.request_counts.get('rate_limited', 0) + 1
+                return False
+            self.rate_limit_remaining -= self.rate_limit_cost
+            return True
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,284 @@
+"""Local fake of the OpenAI chat completions, files and batches endpoints.
+
+    server = FakeOpenAIServer(batch_delay=0.5, latency=0.2, error_rate=0.01, rate_limit_rate=0.05)
+    base_url = server.start()
+    service = GradingService("fake-key", "gpt-4o", 0.5, base_url=base_url)
+    ...
+    server.stop()
+
+Grades are deterministic: the score grows with message length and never
+exceeds the max points named in the prompt. Chat completions can be slowed
+down and made to fail with 500s or 429s (with Retry-After) at set rates, or
+answer with chatter that contains no grade at malformed_rate.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def fake_grade(messages: List[Dict]) -> str:
+    """Produce a `[NUMBER];[EXPLANATION]` reply for a grading conversation"""
+    prompt = messages[-1]['content'] if messages else ""
+    match = re.search(r"between 0 and (\d+(?:\.\d+)?)", prompt)
+    max_points = float(match.group(1)) if match else 10.0
+    grade = round(min(max_points, len(prompt) / 50.0), 1)
+    return f"{grade};Fake feedback for a {len(prompt)} character prompt."
+
+
+def fake_json_grade(messages: List[Dict]) -> str:
+    """Produce a structured `{"grade": ..., "feedback": ...}` reply"""
+    grade, feedback = fake_grade(messages).split(";", 1)
+    return json.dumps({'grade': float(grade), 'feedback': feedback})
+
+
+def fake_packed_grades(messages: List[Dict]) -> str:
+    """Produce a JSON `{"grades": [...]}` reply for a packed grading conversation"""
+    prompt = messages[-1]['content'] if messages else ""
+    match = re.search(r"between 0 and (\d+(?:\.\d+)?)", messages[0]['content'] if messages else "")
+    max_points = float(match.group(1)) if match else 10.0
+    entries = json.loads(prompt[prompt.index("["):]) if "[" in prompt else []
+    return json.dumps({'grades': [
+        {'id': entry['id'],
+         'grade': round(min(max_points, len(entry['text']) / 50.0), 1),
+         'feedback': f"Fake feedback for a {len(entry['text'])} character post."}
+        for entry in entries
+    ]})
+
+
+def _completion(model: str, messages: List[Dict], response_format: Optional[Dict] = None,
+                malformed: bool = False) -> Dict:
+    response_format = response_format or {}
+    if malformed:
+        content = "I'd be happy to help grade this discussion post!"
+    elif response_format.get('type') == "json_schema" and response_format['json_schema'].get('name') == "grade":
+        content = fake_json_grade(messages)
+    elif response_format.get('type') in ("json_object", "json_schema"):
+        content = fake_packed_grades(messages)
+    else:
+        content = fake_grade(messages)
+    prompt_tokens = sum(len(m.get('content', "")) for m in messages) // 4
+    return {
+        'id': "chatcmpl-fake",
+        'object': "chat.completion",
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': "assistant", 'content': content},
+            'finish_reason': "stop"
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': prompt_tokens + len(content) // 4
+        }
+    }
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        fake = self.server.fake
+        path = self.path.split("?")[0]
+        fake.record_request(path)
+        body = self._read_body()
+
+        if path.endswith("/chat/completions"):
+            failure = fake.simulate_call()
+            if failure == 429:
+                fake.record_request("rate_limited")
+                return self._send_json({'error': {'message': "Rate limit reached", 'type': "requests"}},
+                                       429, {'Retry-After': str(fake.retry_after)})
+            if failure == 500:
+                fake.record_request("server_error")
+                return self._send_json({'error': {'message': "The server had an error"}}, 500)
+            request = json.loads(body)
+            malformed = fake.simulate_malformed()
+            if malformed:
+                fake.record_request("malformed")
+            return self._send_json(_completion(request.get('model', ""), request.get('messages', []),
+                                               request.get('response_format'), malformed))
+
+        if path.endswith("/files"):
+            content_type = self.headers.get('Content-Type', "")
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            file_part = next(part for part in message.iter_parts()
+                             if part.get_param('name', header='content-disposition') == 'file')
+            purpose = next((part.get_content().strip() for part in message.iter_parts()
+                            if part.get_param('name', header='content-disposition') == 'purpose'), "batch")
+            file_id = fake.add_file(file_part.get_payload(decode=True), purpose,
+                                    file_part.get_filename() or "upload.jsonl")
+            return self._send_json(fake.files[file_id]['meta'])
+
+        if path.endswith("/batches"):
+            request = json.loads(body)
+            return self._send_json(fake.create_batch(request))
+
+        self._send_json({'error': {'message': "not found"}}, 404)
+
+    def do_GET(self):
+        fake = self.server.fake
+        path = self.path.split("?")[0]
+        fake.record_request(path)
+
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match and match.group(1) in fake.files:
+            return self._send_bytes(fake.files[match.group(1)]['content'], "application/octet-stream")
+
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match and match.group(1) in fake.batches:
+            return self._send_json(fake.refresh_batch(match.group(1)))
+
+        self._send_json({'error': {'message': "not found"}}, 404)
+
+    def _send_json(self, payload, status: int = 200, headers: Optional[Dict] = None):
+        self._send_bytes(json.dumps(payload).encode(), "application/json", status, headers)
+
+    def _send_bytes(self, body: bytes, content_type: str, status: int = 200,
+                    headers: Optional[Dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIServer:
+    """Threaded HTTP server speaking enough of the OpenAI API for GradingService.
+
+    Each chat completion sleeps `latency` seconds (plus up to `latency_jitter`), then
+    fails with a 429 at rate_limit_rate or a 500 at error_rate.
+    """
+    def __init__(self, batch_delay: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 0.1, malformed_rate: float = 0.0,
+                 seed: int = 0):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self.files: Dict[str, Dict] = {}
+        self.batches: Dict[str, Dict] = {}
+        self.request_counts: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _FakeOpenAIHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record_request(self, path: str):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def simulate_call(self) -> Optional[int]:
+        """Apply configured latency and return 429/500 for a simulated failure, else None"""
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.latency_jitter)
+            roll = self._rng.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def simulate_malformed(self) -> bool:
+        """Whether this completion should answer without a grade"""
+        with self._lock:
+            return self._rng.random() < self.malformed_rate
+
+    def add_file(self, content: bytes, purpose: str, filename: str) -> str:
+        with self._lock:
+            file_id = f"file-{next(self._ids)}"
+            self.files[file_id] = {
+                'content': content,
+                'meta': {'id': file_id, 'object': "file", 'bytes': len(content),
+                         'created_at': int(time.time()), 'filename': filename,
+                         'purpose': purpose, 'status': "processed"}
+            }
+        return file_id
+
+    def create_batch(self, request: Dict) -> Dict:
+        with self._lock:
+            batch_id = f"batch_{next(self._ids)}"
+            self.batches[batch_id] = {
+                'id': batch_id,
+                'object': "batch",
+                'endpoint': request['endpoint'],
+                'completion_window': request['completion_window'],
+                'input_file_id': request['input_file_id'],
+                'status': "validating",
+                'output_file_id': None,
+                'error_file_id': None,
+                'created_at': int(time.time()),
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+                '_submitted': time.monotonic()
+            }
+        return self.refresh_batch(batch_id)
+
+    def refresh_batch(self, batch_id: str) -> Dict:
+        """Advance a batch to completed once batch_delay has passed"""
+        batch = self.batches[batch_id]
+        if batch['status'] != "completed":
+            if time.monotonic() - batch['_submitted'] < self.batch_delay:
+                batch['status'] = "in_progress"
+            else:
+                self._complete_batch(batch)
+        return {k: v for k, v in batch.items() if not k.startswith('_')}
+
+    def _complete_batch(self, batch: Dict):
+        lines = self.files[batch['input_file_id']]['content'].decode().splitlines()
+        output = []
+        for line in filter(None, lines):
+            request = json.loads(line)
+            output.append(json.dumps({
+                'id': f"batch_req_{next(self._ids)}",
+                'custom_id': request['custom_id'],
+                'response': {
+                    'status_code': 200,
+                    'body': _completion(request['body'].get('model', ""), request['body']['messages'],
+                                        request['body'].get('response_format'), self.simulate_malformed())
+                },
+                'error': None
+            }))
+        batch['output_file_id'] = self.add_file(("\n".join(output) + "\n").encode(), "batch_output",
+                                                "output.jsonl")
+        batch['request_counts'] = {'total': len(output), 'completed': len(output), 'failed': 0}
+        batch['status'] = "completed"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
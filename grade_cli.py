@@ -0,0 +1,408 @@
+"""Headless grading of whole courses or selected topics, without the Streamlit UI.
+
+Examples:
+    python grade_cli.py --course 1717948
+    python grade_cli.py --topic 1717948:9120860 --topic 1717948:9120861 --workers 16
+    python grade_cli.py --course 1717948 --batch --resume
+    python grade_cli.py --course 1717948 --resume --push-grades --dry-run
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import requests
+
+from src.config import (CANVAS_BASE_URL, DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_POST_POINTS,
+                        DEFAULT_REPLY_POINTS, DEFAULT_SYSTEM_PROMPT, OUTPUT_DIR,
+                        MAX_CONCURRENT_REQUESTS, CANVAS_MAX_WORKERS, MESSAGE_TOKEN_BUDGET,
+                        GRADEBOOK_MAX_POSTS, GRADEBOOK_MAX_REPLIES, GRADEBOOK_BEST_N,
+                        GRADEBOOK_ASSIGNMENT_NAME, CANVAS_GRADE_CHUNK_SIZE, FAST_MODEL,
+                        ROUTING_TOKEN_THRESHOLD)
+from src.canvas_api import CanvasAPI
+from src.data_processor import DiscussionDataProcessor
+from src.grading_service import GradingService
+from src.grading_engine import GradingEngine
+from src.grade_cache import GradeCache
+from src.grade_journal import GradeJournal
+from src.gradebook import Gradebook
+from src.grade_push import GradePush
+from src.model_backend import ModelBackend, ModelRouter
+from src.dedup import DuplicateDetector
+from src.text_preprocessor import MessagePreprocessor
+from src.telemetry import Telemetry
+
+CHECKPOINT_FILE = "grading_checkpoint.json"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Grade Canvas discussion topics from the command line")
+    parser.add_argument("--course", type=int, action="append", default=[],
+                        help="Grade every discussion topic of this course (repeatable)")
+    parser.add_argument("--topic", action="append", default=[], metavar="COURSE_ID:TOPIC_ID",
+                        help="Grade a single topic (repeatable)")
+    parser.add_argument("--canvas-key", default=os.environ.get("CANVAS_API_KEY", ""))
+    parser.add_argument("--openai-key", default=os.environ.get("OPENAI_API_KEY", ""))
+    parser.add_argument("--canvas-url", default=CANVAS_BASE_URL)
+    parser.add_argument("--openai-url", default=None, help="OpenAI-compatible API base URL")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--temperature", type=float, default=DEFAULT_TEMPERATURE)
+    parser.add_argument("--fast-model", default=FAST_MODEL,
+                        help="Cheaper model for short posts; longer posts go to --model")
+    parser.add_argument("--fast-url", default=None,
+                        help="Base URL of the fast model's server, e.g. a local llama.cpp or vLLM "
+                             "(default: --openai-url)")
+    parser.add_argument("--fast-key", default=None, help="API key for --fast-url (default: --openai-key)")
+    parser.add_argument("--route-threshold", type=int, default=ROUTING_TOKEN_THRESHOLD,
+                        help="Posts up to this many tokens go to the fast model")
+    parser.add_argument("--no-escalate", action="store_true",
+                        help="Do not re-ask the strong model when the fast model's answer cannot be parsed")
+    parser.add_argument("--no-json-mode", action="store_true",
+                        help="Do not send response_format (for servers without JSON mode)")
+    parser.add_argument("--post-points", type=float, default=DEFAULT_POST_POINTS)
+    parser.add_argument("--reply-points", type=float, default=DEFAULT_REPLY_POINTS)
+    parser.add_argument("--prompt", default=DEFAULT_SYSTEM_PROMPT, help="Grading instructions")
+    parser.add_argument("--prompt-file", help="Read grading instructions from this file")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_REQUESTS,
+                        help="Concurrent grading requests")
+    parser.add_argument("--canvas-workers", type=int, default=CANVAS_MAX_WORKERS,
+                        help="Concurrent Canvas downloads")
+    parser.add_argument("--token-budget", type=int, default=MESSAGE_TOKEN_BUDGET,
+                        help="Truncate messages longer than this many tokens")
+    parser.add_argument("--packed", action="store_true", help="Pack short posts into shared requests")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Grade identical and near-identical posts once and flag copies across students")
+    parser.add_argument("--batch", action="store_true", help="Grade through the OpenAI Batch API")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip topics already completed according to the checkpoint "
+                             "(posts journaled by an interrupted run are always skipped)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not reuse or store cached grades")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--gradebook", action="store_true",
+                        help="Write per-student totals across the selected topics as a Canvas "
+                             "gradebook-import CSV and Parquet")
+    parser.add_argument("--max-posts", type=int, default=GRADEBOOK_MAX_POSTS,
+                        help="Posts counted per student per topic")
+    parser.add_argument("--max-replies", type=int, default=GRADEBOOK_MAX_REPLIES,
+                        help="Replies counted per student per topic")
+    parser.add_argument("--best-n", type=int, default=GRADEBOOK_BEST_N,
+                        help="Count only each student's best N topics")
+    parser.add_argument("--assignment-name", default=GRADEBOOK_ASSIGNMENT_NAME)
+    parser.add_argument("--assignment-id", type=int, help="Canvas assignment id for the import column")
+    parser.add_argument("--push-grades", action="store_true",
+                        help="Send per-student topic totals and feedback to each topic's Canvas assignment")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="With --push-grades, only diff against the current gradebook and write the plan")
+    parser.add_argument("--push-chunk-size", type=int, default=CANVAS_GRADE_CHUNK_SIZE,
+                        help="Students per bulk grade update request")
+    parser.add_argument("--metrics-json", help="Write per-call telemetry and a summary to this JSON file")
+    parser.add_argument("--metrics-csv", help="Write per-call telemetry records to this CSV file")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics on this port at /metrics while grading")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def resolve_topics(canvas_api: CanvasAPI, args: argparse.Namespace) -> List[Tuple[int, int]]:
+    """Expand --course and --topic arguments into (course_id, topic_id) pairs"""
+    topics = []
+    for course_id in args.course:
+        topic_list = canvas_api.get_discussion_topics(course_id)
+        logging.info(f"Course {course_id}: {len(topic_list)} discussion topics")
+        topics.extend((course_id, topic_id) for topic_id, _ in topic_list)
+    for spec in args.topic:
+        course_id, _, topic_id = spec.partition(":")
+        topics.append((int(course_id), int(topic_id)))
+    return list(dict.fromkeys(topics))
+
+
+def load_checkpoint(path: str) -> Dict:
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {'completed': []}
+
+
+def save_checkpoint(path: str, checkpoint: Dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_topic_output(df_posts, output_dir: str, identifier: str) -> str:
+    """Write one topic's graded CSV atomically so partial files never appear"""
+    output_file = os.path.join(output_dir, f"graded_discussion_{identifier}.csv")
+    tmp_file = output_file + ".tmp"
+    df_posts.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def load_topics(canvas_api: CanvasAPI, topics: List[Tuple[int, int]],
+                preprocessor: MessagePreprocessor,
+                workers: int = CANVAS_MAX_WORKERS) -> Dict[str, object]:
+    """Stream, parse and preprocess every topic concurrently"""
+    def load(topic):
+        course_id, topic_id = topic
+        try:
+            _, df_posts = DiscussionDataProcessor.process_discussion_stream(
+                canvas_api.stream_discussion_data(course_id, topic_id))
+            return preprocessor.preprocess_dataframe(df_posts)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.warning(f"Could not load topic {course_id}:{topic_id}: {e}")
+            return None
+
+    frames = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (course_id, topic_id), df_posts in zip(topics, executor.map(load, topics)):
+            if df_posts is not None:
+                frames[f"{course_id}_{topic_id}"] = df_posts
+    return frames
+
+
+def grade_topics(grading_service: GradingService, frames: Dict[str, object],
+                 args: argparse.Namespace, system_prompt: str,
+                 checkpoint: Dict, checkpoint_path: str) -> int:
+    """Grade each topic with the concurrent engine, journaling every grade as it arrives"""
+    engine = GradingEngine(grading_service, max_workers=args.workers, packed=args.packed)
+    settings = GradeJournal.settings_key(args.post_points, args.reply_points, system_prompt,
+                                         grading_service.model_label, grading_service.temperature)
+    journal_dir = os.path.join(args.output_dir, "journal")
+    failures = 0
+    for n, (identifier, df_posts) in enumerate(frames.items(), 1):
+        if df_posts.empty:
+            logging.info(f"[{n}/{len(frames)}] {identifier}: no posts")
+            continue
+        journal = GradeJournal(identifier, journal_dir)
+        to_grade = journal.pending(df_posts, settings)
+        for result in engine.grade_posts(to_grade, args.post_points, args.reply_points, system_prompt):
+            if result.error is not None:
+                logging.error(f"{identifier}: post at row {result.index} failed: {result.error}")
+                continue
+            row = to_grade.loc[result.index]
+            journal.append(row['post_id'], row.get('updated_at'), settings, result.grade, result.feedback)
+
+        graded = journal.apply(df_posts, settings)
+        missing = int(graded['grade_numeric'].isna().sum())
+        failures += missing
+        output_file = write_topic_output(graded, args.output_dir, identifier)
+        logging.info(f"[{n}/{len(frames)}] {identifier}: graded {len(graded) - missing}/{len(graded)} "
+                     f"posts ({len(df_posts) - len(to_grade)} resumed from journal) -> {output_file}")
+        if missing == 0:
+            checkpoint['completed'].append(identifier)
+            save_checkpoint(checkpoint_path, checkpoint)
+    return failures
+
+
+def grade_topics_batch(grading_service: GradingService, frames: Dict[str, object],
+                       args: argparse.Namespace, system_prompt: str,
+                       checkpoint: Dict, checkpoint_path: str) -> int:
+    """Grade all topics in one Batch API job and write each topic's CSV"""
+    from src.batch_grading import BatchGradingJob
+
+    # The job name is stable for the same topic set so an interrupted run resumes its batches
+    job_name = "batch_" + hashlib.sha256(",".join(sorted(frames)).encode()).hexdigest()[:16]
+    job = BatchGradingJob(grading_service, job_name, os.path.join(args.output_dir, "batch_jobs"))
+    graded_frames = job.run(frames, args.post_points, args.reply_points, system_prompt)
+    failures = 0
+    for identifier, graded in graded_frames.items():
+        missing = int(graded['grade_numeric'].isna().sum())
+        failures += missing
+        output_file = write_topic_output(graded, args.output_dir, identifier)
+        logging.info(f"{identifier}: graded {len(graded) - missing}/{len(graded)} posts -> {output_file}")
+        if missing == 0:
+            checkpoint['completed'].append(identifier)
+    save_checkpoint(checkpoint_path, checkpoint)
+    return failures
+
+
+def load_graded_topics(topics: List[Tuple[int, int]], args: argparse.Namespace) -> Dict[Tuple[int, int], pd.DataFrame]:
+    """Read back the graded CSV of every selected topic that has one"""
+    columns = ('user_id', 'display_name', 'type', 'grade_numeric', 'grade_feedback')
+    frames = {}
+    for course_id, topic_id in topics:
+        path = os.path.join(args.output_dir, f"graded_discussion_{course_id}_{topic_id}.csv")
+        if os.path.exists(path):
+            frames[(course_id, topic_id)] = pd.read_csv(path, usecols=lambda c: c in columns)
+    return frames
+
+
+def write_gradebook(topics: List[Tuple[int, int]], args: argparse.Namespace) -> Optional[str]:
+    """Aggregate the graded CSVs of every selected topic into per-student totals"""
+    frames = {f"{course_id}_{topic_id}": df
+              for (course_id, topic_id), df in load_graded_topics(topics, args).items()}
+    if not frames:
+        logging.warning("No graded topics found for the gradebook")
+        return None
+
+    gradebook = Gradebook.aggregate(Gradebook.combine_topics(frames), args.max_posts,
+                                    args.max_replies, args.best_n)
+    topics_counted = min(args.best_n or len(frames), len(frames))
+    points_possible = (args.post_points * args.max_posts + args.reply_points * args.max_replies) * topics_counted
+    output_file = os.path.join(args.output_dir, "gradebook.csv")
+    with open(output_file, "w", encoding="utf-8", newline="") as f:
+        f.write(Gradebook.to_canvas_csv(gradebook, args.assignment_name, args.assignment_id,
+                                        points_possible))
+    try:
+        Gradebook.to_parquet(gradebook, os.path.join(args.output_dir, "gradebook.parquet"))
+    except ImportError:
+        logging.warning("pyarrow is not installed; skipping Parquet gradebook export")
+    logging.info(f"Gradebook for {len(gradebook)} students across {len(frames)} topics -> {output_file}")
+    return output_file
+
+
+def push_grades(canvas_api: CanvasAPI, topics: List[Tuple[int, int]], args: argparse.Namespace) -> int:
+    """Push each graded topic's per-student totals to its Canvas assignment; returns failed students"""
+    pusher = GradePush(canvas_api, chunk_size=args.push_chunk_size)
+    failed = 0
+    for (course_id, topic_id), df_graded in load_graded_topics(topics, args).items():
+        identifier = f"{course_id}_{topic_id}"
+        try:
+            assignment_id = canvas_api.get_topic_assignment_id(course_id, topic_id)
+            if assignment_id is None:
+                logging.warning(f"{identifier}: topic is not a graded discussion; nothing to push")
+                continue
+            scores = Gradebook.aggregate(df_graded, args.max_posts, args.max_replies)
+            plan = pusher.plan(course_id, assignment_id, scores, GradePush.build_comments(df_graded))
+            if args.dry_run:
+                plan_file = os.path.join(args.output_dir, f"push_plan_{identifier}.csv")
+                plan.to_csv(plan_file, index=False)
+            summary = pusher.push(course_id, assignment_id, plan, dry_run=args.dry_run)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"{identifier}: could not push grades: {e}")
+            failed += len(df_graded['user_id'].unique())
+            continue
+        failed += summary['failed']
+        if args.dry_run:
+            logging.info(f"{identifier}: {summary['changed']}/{summary['students']} scores would change "
+                         f"on assignment {assignment_id} (dry run) -> {plan_file}")
+        else:
+            logging.info(f"{identifier}: sent {summary['sent']}/{summary['changed']} changed scores to "
+                         f"assignment {assignment_id} ({summary['students'] - summary['changed']} unchanged, "
+                         f"{summary['failed']} failed)")
+    return failed
+
+
+def report_telemetry(telemetry: Telemetry, args: argparse.Namespace):
+    """Log the per-kind telemetry summary and write the requested metric exports"""
+    for kind, stats in telemetry.summary().items():
+        logging.info(f"{kind}: {stats['calls']} calls, {stats['errors']} errors, {stats['retries']} retries, "
+                     f"p50/p95/p99 {stats['p50_latency']:.2f}/{stats['p95_latency']:.2f}/"
+                     f"{stats['p99_latency']:.2f}s, {stats['throughput_per_sec']:.1f}/s, "
+                     f"{stats['prompt_tokens'] + stats['completion_tokens']} tokens, ${stats['cost']:.4f}")
+    if args.metrics_json:
+        with open(args.metrics_json, "w", encoding="utf-8") as f:
+            f.write(telemetry.to_json())
+    if args.metrics_csv:
+        with open(args.metrics_csv, "w", encoding="utf-8", newline="") as f:
+            f.write(telemetry.to_csv())
+
+
+def build_router(args: argparse.Namespace) -> ModelRouter:
+    """Strong backend from --model/--openai-url, plus an optional fast backend for short posts"""
+    json_mode = not args.no_json_mode
+    strong = ModelBackend(args.model, args.openai_key, args.openai_url, json_mode=json_mode)
+    fast = None
+    if args.fast_model:
+        fast = ModelBackend(args.fast_model, args.fast_key or args.openai_key,
+                            args.fast_url or args.openai_url, json_mode=json_mode)
+    return ModelRouter(strong, fast, token_threshold=args.route_threshold, escalate=not args.no_escalate)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if not args.verbose:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    # Local OpenAI-compatible servers (--openai-url) usually need no key
+    if not args.canvas_key or not (args.openai_key or args.openai_url):
+        logging.error("Canvas and OpenAI API keys are required (--canvas-key/--openai-key or environment)")
+        return 2
+    if args.batch and args.fast_model:
+        logging.warning("Batch grading uses --model only; --fast-model is ignored")
+    if not args.course and not args.topic:
+        logging.error("Nothing to grade: pass --course and/or --topic")
+        return 2
+
+    system_prompt = args.prompt
+    if args.prompt_file:
+        with open(args.prompt_file, encoding="utf-8") as f:
+            system_prompt = f.read().strip()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.output_dir, CHECKPOINT_FILE)
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else {'completed': []}
+
+    telemetry = Telemetry()
+    if args.metrics_port:
+        telemetry.serve_prometheus(args.metrics_port)
+        logging.info(f"Serving Prometheus metrics on port {args.metrics_port} at /metrics")
+    canvas_api = CanvasAPI(args.canvas_url, args.canvas_key, max_workers=args.canvas_workers,
+                           telemetry=telemetry)
+    cache = None if args.no_cache else GradeCache(os.path.join(args.output_dir, "grade_cache.sqlite3"))
+    grading_service = GradingService(args.openai_key, args.model, args.temperature, cache=cache,
+                                     base_url=args.openai_url, telemetry=telemetry,
+                                     router=build_router(args))
+
+    topics = resolve_topics(canvas_api, args)
+    done = set(checkpoint['completed'])
+    pending = [(c, t) for c, t in topics if f"{c}_{t}" not in done]
+    logging.info(f"{len(topics)} topics selected, {len(topics) - len(pending)} already completed")
+    if not pending:
+        if args.gradebook:
+            write_gradebook(topics, args)
+        if args.push_grades:
+            return 1 if push_grades(canvas_api, topics, args) else 0
+        return 0
+
+    preprocessor = MessagePreprocessor(token_budget=args.token_budget)
+    frames = load_topics(canvas_api, pending, preprocessor, args.canvas_workers)
+    stats = preprocessor.summary()
+    logging.info(f"Preprocessing: {stats['original_tokens']} -> {stats['cleaned_tokens']} message tokens "
+                 f"({stats['percent_saved']:.0f}% saved, {stats['truncated']} truncated)")
+    if args.dedup:
+        detector = DuplicateDetector()
+        frames = {identifier: detector.annotate(df_posts) for identifier, df_posts in frames.items()}
+        duplicates = sum(int(df['duplicate_of'].notna().sum()) for df in frames.values())
+        flagged = sum(int(df.loc[df['flag_review'], 'duplicate_cluster'].nunique()) for df in frames.values())
+        logging.info(f"Deduplication: {duplicates} posts reuse a representative's grade, "
+                     f"{flagged} groups written by different students flagged for review")
+    if args.batch:
+        failures = grade_topics_batch(grading_service, frames, args, system_prompt,
+                                      checkpoint, checkpoint_path)
+    else:
+        failures = grade_topics(grading_service, frames, args, system_prompt,
+                                checkpoint, checkpoint_path)
+
+    report_telemetry(telemetry, args)
+    parsing = grading_service.parse_report()
+    if parsing['responses']:
+        logging.info(f"Response parsing: {parsing['parse_failure_rate']:.1%} of {parsing['responses']} answers "
+                     f"had no readable grade, {parsing['reasks']} re-asks, {parsing['parse_failures']} posts "
+                     f"left ungraded, {parsing['clamped']} grades clamped to the point range")
+    if grading_service.router.fast is not None:
+        routing = grading_service.stats
+        logging.info(f"Model routing: {routing['fast_requests']} fast requests, "
+                     f"{routing['strong_requests']} strong requests, {routing['escalations']} escalations")
+    if args.gradebook:
+        write_gradebook(topics, args)
+    push_failures = push_grades(canvas_api, topics, args) if args.push_grades else 0
+    if failures:
+        logging.warning(f"{failures} posts could not be graded; rerun with --resume to retry them")
+    if len(frames) < len(pending):
+        logging.warning(f"{len(pending) - len(frames)} topics could not be downloaded")
+    if push_failures:
+        logging.warning(f"{push_failures} student grades could not be pushed to Canvas")
+    return 1 if failures or push_failures or len(frames) < len(pending) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
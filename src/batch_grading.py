@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.text_preprocessor import grading_text_column
+from src.dedup import duplicate_followers
+from src.grading_service import GRADE_RESPONSE_FORMAT
+from src.config import (BATCH_STATE_DIR, BATCH_POLL_INTERVAL, BATCH_MAX_REQUESTS,
+                        BATCH_COMPLETION_WINDOW)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchGradingJob:
+    """Grades posts from many topics through the OpenAI Batch API.
+
+    Submitted batch ids and downloaded results are kept under state_dir/<name>/,
+    so an interrupted run picks up the same batches instead of paying again.
+    Grades obtained by re-asking unreadable answers are kept in the state too.
+    Rerunning a finished job resubmits only the posts still without a grade.
+    """
+    def __init__(self, grading_service, name: str, state_dir: str = BATCH_STATE_DIR):
+        self.grading_service = grading_service
+        self.client = grading_service.client
+        self.dir = os.path.join(state_dir, name)
+        self.state_path = os.path.join(self.dir, "state.json")
+        self.results_path = os.path.join(self.dir, "results.jsonl")
+        os.makedirs(self.dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {'settings': None, 'batches': [], 'fallback_grades': {}}
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def custom_id(identifier: str, post_id) -> str:
+        return f"{identifier}:{post_id}"
+
+    def _settings_hash(self, post_points: float, reply_points: float, system_prompt: str) -> str:
+        payload = json.dumps([float(post_points), float(reply_points), system_prompt,
+                              self.grading_service.model, self.grading_service.temperature])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def build_requests(self,
+                       topics: Dict[str, pd.DataFrame],
+                       post_points: float,
+                       reply_points: float,
+                       system_prompt: str) -> List[Dict]:
+        """Build one /v1/chat/completions batch line per post that is not already cached.
+
+        Duplicates marked by DuplicateDetector.annotate are left to their representative.
+        """
+        requests = []
+        structured = self.grading_service.router.strong.json_mode
+        for identifier, df_posts in topics.items():
+            text_column = grading_text_column(df_posts)
+            duplicates = [idx for members in duplicate_followers(df_posts).values() for idx in members]
+            for _, row in df_posts.drop(index=duplicates).iterrows():
+                if self.grading_service.cached_grade(
+                        row[text_column], row['type'], post_points, reply_points, system_prompt):
+                    continue
+                max_points = post_points if row['type'] == 'post' else reply_points
+                body = {
+                    'model': self.grading_service.model,
+                    'temperature': self.grading_service.temperature,
+                    'messages': self.grading_service._create_messages(
+                        row[text_column], row['type'], max_points, system_prompt, structured)
+                }
+                if structured:
+                    body['response_format'] = GRADE_RESPONSE_FORMAT
+                requests.append({
+                    'custom_id': self.custom_id(identifier, row['post_id']),
+                    'method': "POST",
+                    'url': "/v1/chat/completions",
+                    'body': body
+                })
+        return requests
+
+    def submit(self, requests: List[Dict]):
+        """Upload the requests as JSONL files and create one batch per BATCH_MAX_REQUESTS chunk"""
+        for start in range(0, len(requests), BATCH_MAX_REQUESTS):
+            chunk = requests[start:start + BATCH_MAX_REQUESTS]
+            input_path = os.path.join(self.dir, f"input_{start // BATCH_MAX_REQUESTS}.jsonl")
+            with open(input_path, "w", encoding="utf-8") as f:
+                for request in chunk:
+                    f.write(json.dumps(request) + "\n")
+            with open(input_path, "rb") as f:
+                input_file = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window=BATCH_COMPLETION_WINDOW
+            )
+            self.state['batches'].append({
+                'id': batch.id,
+                'input_file_id': input_file.id,
+                'status': batch.status,
+                # A batch can already be finished when created, and poll() skips finished batches
+                'output_file_id': batch.output_file_id,
+                'error_file_id': batch.error_file_id,
+                'downloaded': False
+            })
+            self._save_state()
+            logging.info(f"Submitted batch {batch.id} with {len(chunk)} requests")
+
+    def poll(self, interval: float = BATCH_POLL_INTERVAL, timeout: Optional[float] = None):
+        """Wait until every submitted batch reaches a terminal status"""
+        started = time.monotonic()
+        while True:
+            for record in self.state['batches']:
+                if record['status'] in TERMINAL_STATUSES:
+                    continue
+                batch = self.client.batches.retrieve(record['id'])
+                record['status'] = batch.status
+                record['output_file_id'] = batch.output_file_id
+                record['error_file_id'] = batch.error_file_id
+            self._save_state()
+            if all(record['status'] in TERMINAL_STATUSES for record in self.state['batches']):
+                return
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError("Batch grading did not finish before the timeout")
+            time.sleep(interval)
+
+    def collect(self) -> Dict[str, str]:
+        """Download finished batch outputs once and return model text by custom_id"""
+        for record in self.state['batches']:
+            if record['downloaded'] or record['status'] not in TERMINAL_STATUSES:
+                continue
+            if record['status'] != "completed":
+                logging.error(f"Batch {record['id']} ended with status {record['status']}")
+            if record['error_file_id']:
+                errors = self.client.files.content(record['error_file_id']).text
+                logging.error(f"Batch {record['id']} had {len(errors.splitlines())} failed requests")
+            if record['output_file_id']:
+                output = self.client.files.content(record['output_file_id']).text
+                with open(self.results_path, "a", encoding="utf-8") as f:
+                    f.write(output if output.endswith("\n") or not output else output + "\n")
+            record['downloaded'] = True
+            self._save_state()
+
+        responses = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    response = result.get('response') or {}
+                    if response.get('status_code') == 200:
+                        responses[result['custom_id']] = \
+                            response['body']['choices'][0]['message']['content']
+        return responses
+
+    def merge(self,
+              topics: Dict[str, pd.DataFrame],
+              responses: Dict[str, str],
+              post_points: float,
+              reply_points: float,
+              system_prompt: str) -> Dict[str, pd.DataFrame]:
+        """Attach grade_numeric/grade_feedback to copies of each topic DataFrame.
+
+        Answers without a readable grade are re-asked one post at a time through
+        the synchronous path, and the grades saved in the job state so a rerun
+        neither re-asks nor resubmits them; posts that still fail stay ungraded.
+        """
+        fallback_grades = self.state.setdefault('fallback_grades', {})
+        graded = {}
+        for identifier, df_posts in topics.items():
+            text_column = grading_text_column(df_posts)
+            df_graded = df_posts.copy()
+            df_graded['grade_numeric'] = None
+            df_graded['grade_feedback'] = None
+            for idx, row in df_graded.iterrows():
+                custom_id = self.custom_id(identifier, row['post_id'])
+                content = responses.get(custom_id)
+                if content is not None:
+                    max_points = post_points if row['type'] == 'post' else reply_points
+                    parsed = self.grading_service.read_grade(content, max_points)
+                    if parsed is None and custom_id in fallback_grades:
+                        parsed = tuple(fallback_grades[custom_id])
+                    elif parsed is None:
+                        try:
+                            parsed = self.grading_service.request_grade(
+                                row[text_column], row['type'], post_points, reply_points, system_prompt)
+                        except Exception as e:
+                            logging.error(f"Error grading post {row['post_id']}: {e}")
+                            continue
+                        fallback_grades[custom_id] = list(parsed)
+                        self._save_state()
+                    else:
+                        self.grading_service.store_grade(
+                            row[text_column], row['type'], max_points, system_prompt, *parsed)
+                    grade, feedback = parsed
+                else:
+                    cached = self.grading_service.cached_grade(
+                        row[text_column], row['type'], post_points, reply_points, system_prompt)
+                    if cached is None:
+                        continue
+                    grade, feedback = cached
+                df_graded.at[idx, 'grade_numeric'] = grade
+                df_graded.at[idx, 'grade_feedback'] = feedback
+            for representative, members in duplicate_followers(df_graded).items():
+                df_graded.loc[members, 'grade_numeric'] = df_graded.at[representative, 'grade_numeric']
+                df_graded.loc[members, 'grade_feedback'] = df_graded.at[representative, 'grade_feedback']
+            graded[identifier] = df_graded
+        return graded
+
+    def run(self,
+            topics: Dict[str, pd.DataFrame],
+            post_points: float,
+            reply_points: float,
+            system_prompt: str,
+            poll_interval: float = BATCH_POLL_INTERVAL,
+            timeout: Optional[float] = None) -> Dict[str, pd.DataFrame]:
+        """Submit (or resume), wait for, and merge a batch grading run"""
+        settings = self._settings_hash(post_points, reply_points, system_prompt)
+        if self.state['settings'] not in (None, settings):
+            raise ValueError(f"Batch job in {self.dir} was created with different grading settings")
+        self.state['settings'] = settings
+
+        if not self.state['batches']:
+            requests = self.build_requests(topics, post_points, reply_points, system_prompt)
+            if requests:
+                self.submit(requests)
+            else:
+                self._save_state()
+        elif all(record['status'] in TERMINAL_STATUSES for record in self.state['batches']):
+            # A previous run finished: resubmit posts whose batch failed or expired, that only
+            # appear in an error file, or whose answer held no readable grade and was not
+            # graded by merge()'s synchronous re-ask either
+            answered = {custom_id for custom_id, content in self.collect().items()
+                        if self.grading_service._try_parse_grade(content) is not None}
+            answered.update(self.state.get('fallback_grades', {}))
+            retry = [request for request in self.build_requests(topics, post_points, reply_points, system_prompt)
+                     if request['custom_id'] not in answered]
+            if retry:
+                logging.info(f"Resubmitting {len(retry)} requests without a usable answer")
+                self.submit(retry)
+        self.poll(poll_interval, timeout)
+        return self.merge(topics, self.collect(), post_points, reply_points, system_prompt)
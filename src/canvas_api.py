@@ -1,43 +1,223 @@
 import requests
+import copy
+import hashlib
 import logging
-from typing import Dict, List, Tuple, Optional
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple, Optional
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
+from src.config import (DEFAULT_PARAMS, CANVAS_MAX_WORKERS, CANVAS_TIMEOUT,
+                        CANVAS_RATE_LIMIT_THRESHOLD, CANVAS_MAX_THROTTLE_DELAY,
+                        CANVAS_CACHE_TTL, CANVAS_CACHE_DIR, CANVAS_STREAM_CHUNK_SIZE)
+from src.response_cache import ResponseCache
+from src.json_stream import iter_object_items
+from src.telemetry import Telemetry
+
 class CanvasAPI:
-    def __init__(self, base_url: str, api_key: str):
+    def __init__(self, base_url: str, api_key: str, max_workers: int = CANVAS_MAX_WORKERS,
+                 cache: Optional[ResponseCache] = None, telemetry: Optional[Telemetry] = None):
         self.base_url = base_url
         self.api_key = api_key
-        self.params = {"access_token": api_key}
-    
-    def _make_request(self, endpoint: str) -> Optional[Dict]:
-        """Make API request with error handling"""
+        self.cache = cache if cache is not None else ResponseCache(CANVAS_CACHE_TTL, CANVAS_CACHE_DIR)
+        self.telemetry = telemetry
+        self.rate_limit_remaining: Optional[float] = None
+        self._rate_limit_lock = threading.Lock()
+
+        # One pooled keep-alive session shared by every request (and worker thread)
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def with_telemetry(self, telemetry: Optional[Telemetry]) -> 'CanvasAPI':
+        """A view of this client that records into its own telemetry while sharing the
+        connection pool and response cache"""
+        view = copy.copy(self)
+        view.telemetry = telemetry
+        return view
+
+    def _throttle(self) -> float:
+        """Slow down as Canvas's X-Rate-Limit-Remaining bucket drains; returns the delay"""
+        with self._rate_limit_lock:
+            remaining = self.rate_limit_remaining
+        if remaining is not None and remaining < CANVAS_RATE_LIMIT_THRESHOLD:
+            shortfall = (CANVAS_RATE_LIMIT_THRESHOLD - max(remaining, 0)) / CANVAS_RATE_LIMIT_THRESHOLD
+            time.sleep(shortfall * CANVAS_MAX_THROTTLE_DELAY)
+            return shortfall * CANVAS_MAX_THROTTLE_DELAY
+        return 0.0
+
+    def _record_rate_limit(self, response: requests.Response):
+        remaining = response.headers.get("X-Rate-Limit-Remaining")
+        if remaining is not None:
+            try:
+                with self._rate_limit_lock:
+                    self.rate_limit_remaining = float(remaining)
+            except ValueError:
+                pass
+
+    def _get(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+             retries: int = 3, stream: bool = False) -> requests.Response:
+        """GET through the pooled session, backing off when Canvas reports rate limiting"""
+        return self._request("GET", url, params=params, headers=headers, retries=retries, stream=stream)
+
+    def _request(self, method: str, url: str, params: Optional[Dict] = None,
+                 headers: Optional[Dict] = None, data: Optional[Dict] = None,
+                 retries: int = 3, stream: bool = False) -> requests.Response:
+        """Send a request through the pooled session, retrying when Canvas reports rate limiting"""
+        start = time.perf_counter()
+        throttled = 0.0
+        attempt = 0
+        ok = False
         try:
-            response = requests.get(f"{self.base_url}{endpoint}", params=self.params)
+            for attempt in range(retries + 1):
+                throttled += self._throttle()
+                response = self.session.request(method, url, params=params, headers=headers, data=data,
+                                                timeout=CANVAS_TIMEOUT, stream=stream)
+                self._record_rate_limit(response)
+                rate_limited = (response.status_code == 429 or
+                                (response.status_code == 403 and "Rate Limit Exceeded" in response.text))
+                if not rate_limited or attempt == retries:
+                    break
+                time.sleep(CANVAS_MAX_THROTTLE_DELAY * (2 ** attempt))
             response.raise_for_status()
-            return response.json()
+            ok = True
+            return response
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.record('canvas', time.perf_counter() - start, queue_wait=throttled,
+                                      retries=attempt, ok=ok, detail=f"{method} {url.split('?')[0]}")
+
+    def _fetch(self, url: str, params: Optional[Dict] = None, use_cache: bool = True) -> Dict:
+        """GET a JSON resource, serving fresh cache entries and revalidating stale ones.
+
+        Returns a cache entry dict with data, next_url and payload_hash.
+        """
+        key = ResponseCache.make_key(url, params)
+        entry = self.cache.get(key) if use_cache else None
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self._get(url, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(key, entry)
+            return entry
+
+        entry = {
+            'data': response.json(),
+            'next_url': response.links.get("next", {}).get("url"),
+            'etag': response.headers.get("ETag"),
+            'last_modified': response.headers.get("Last-Modified"),
+            'payload_hash': hashlib.sha256(response.content).hexdigest()
+        }
+        self.cache.put(key, entry)
+        return entry
+
+    def _make_request(self, endpoint: str, use_cache: bool = True) -> Optional[Dict]:
+        """Make API request with error handling"""
+        entry = self._make_cached_request(endpoint, use_cache)
+        return entry['data'] if entry else None
+
+    def _make_cached_request(self, endpoint: str, use_cache: bool = True) -> Optional[Dict]:
+        try:
+            return self._fetch(f"{self.base_url}{endpoint}", DEFAULT_PARAMS, use_cache)
         except requests.exceptions.RequestException as e:
             logging.error(f"API request failed: {e}")
             return None
 
-    def get_courses(self) -> List[Tuple[int, str]]:
+    def _paginate(self, endpoint: str, use_cache: bool = True,
+                  raise_errors: bool = False) -> Iterator[Dict]:
+        """Yield every item of a list endpoint, following Link: rel="next" headers"""
+        url = f"{self.base_url}{endpoint}"
+        params = DEFAULT_PARAMS
+        while url:
+            try:
+                entry = self._fetch(url, params, use_cache)
+            except requests.exceptions.RequestException as e:
+                if raise_errors:
+                    raise
+                logging.error(f"API request failed: {e}")
+                return
+            yield from entry['data']
+            # The next link already carries per_page and the page cursor
+            url = entry['next_url']
+            params = None
+
+    def get_courses(self, use_cache: bool = True) -> List[Tuple[int, str]]:
         """Fetch available courses"""
-        data = self._make_request("/courses")
-        if data:
-            return [(course['id'], course['name']) 
-                    for course in data 
-                    if 'name' in course]
-        return []
-
-    def get_discussion_topics(self, course_id: int) -> List[Tuple[int, str]]:
+        return [(course['id'], course['name'])
+                for course in self._paginate("/courses", use_cache)
+                if 'name' in course]
+
+    def get_discussion_topics(self, course_id: int, use_cache: bool = True) -> List[Tuple[int, str]]:
         """Fetch discussion topics for a course"""
-        data = self._make_request(f"/courses/{course_id}/discussion_topics")
-        if data:
-            return [(topic['id'], topic['title']) 
-                    for topic in data]
-        return []
+        return [(topic['id'], topic['title'])
+                for topic in self._paginate(f"/courses/{course_id}/discussion_topics", use_cache)]
 
-    def get_discussion_data(self, course_id: int, topic_id: int) -> Optional[Dict]:
+    def get_discussion_data(self, course_id: int, topic_id: int,
+                            use_cache: bool = True) -> Optional[Dict]:
         """Fetch discussion posts and participants"""
         return self._make_request(
-            f"/courses/{course_id}/discussion_topics/{topic_id}/view"
-        ) 
\ No newline at end of file
+            f"/courses/{course_id}/discussion_topics/{topic_id}/view", use_cache
+        )
+
+    def get_discussion_data_with_hash(self, course_id: int, topic_id: int,
+                                      use_cache: bool = True) -> Tuple[Optional[Dict], Optional[str]]:
+        """Fetch discussion data along with a hash of the raw payload, for memoized parsing"""
+        entry = self._make_cached_request(
+            f"/courses/{course_id}/discussion_topics/{topic_id}/view", use_cache
+        )
+        if entry is None:
+            return None, None
+        return entry['data'], entry['payload_hash']
+
+    def stream_discussion_data(self, course_id: int, topic_id: int) -> Iterator[Tuple[str, object]]:
+        """Stream a topic's /view payload as (key, element) pairs without loading it whole.
+
+        Yields one item per participant, top-level thread and new entry, so only
+        one thread is held in memory at a time. Streamed payloads bypass the cache.
+        """
+        url = f"{self.base_url}/courses/{course_id}/discussion_topics/{topic_id}/view"
+        response = self._get(url, params=DEFAULT_PARAMS, stream=True)
+        try:
+            yield from iter_object_items(response.iter_content(chunk_size=CANVAS_STREAM_CHUNK_SIZE))
+        finally:
+            response.close()
+
+    def get_topic_assignment_id(self, course_id: int, topic_id: int) -> Optional[int]:
+        """Assignment id of a graded discussion topic (None for ungraded topics)"""
+        topic = self._make_request(f"/courses/{course_id}/discussion_topics/{topic_id}", use_cache=False)
+        return topic.get('assignment_id') if topic else None
+
+    def get_submission_scores(self, course_id: int, assignment_id: int) -> Dict[int, Optional[float]]:
+        """Current gradebook score of every student on an assignment; raises on request errors"""
+        endpoint = f"/courses/{course_id}/assignments/{assignment_id}/submissions"
+        return {submission['user_id']: submission.get('score')
+                for submission in self._paginate(endpoint, use_cache=False, raise_errors=True)}
+
+    def update_grades(self, course_id: int, assignment_id: int,
+                      grades: Dict[int, Tuple[float, Optional[str]]]) -> Dict:
+        """Queue a bulk update of {user_id: (score, comment)}; returns the Canvas Progress object"""
+        data = {}
+        for user_id, (score, comment) in grades.items():
+            data[f"grade_data[{user_id}][posted_grade]"] = f"{round(float(score), 2):g}"
+            if comment:
+                data[f"grade_data[{user_id}][text_comment]"] = comment
+        url = f"{self.base_url}/courses/{course_id}/assignments/{assignment_id}/submissions/update_grades"
+        return self._request("POST", url, data=data).json()
+
+    def get_progress(self, progress_id: int) -> Dict:
+        """Fetch a Canvas Progress object, e.g. for a bulk grade update"""
+        return self._get(f"{self.base_url}/progress/{progress_id}").json()
+
+    def close(self):
+        self.session.close()
@@ -14,9 +14,86 @@ DEFAULT_PARAMS = {
 DEFAULT_MODEL = "gpt-4o"
 DEFAULT_TEMPERATURE = 0.5
 
+# Optional cheaper model for short posts (None = grade everything with DEFAULT_MODEL)
+FAST_MODEL = None
+ROUTING_TOKEN_THRESHOLD = 150  # Posts with at most this many tokens go to FAST_MODEL
+ESCALATE_ON_PARSE_FAILURE = True  # Re-grade with DEFAULT_MODEL when FAST_MODEL's answer cannot be parsed
+
+# Estimated USD price per million (prompt, completion) tokens, used for cost telemetry
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
 # Grading Configuration
 DEFAULT_POST_POINTS = 20
 DEFAULT_REPLY_POINTS = 7.5
+DEFAULT_SYSTEM_PROMPT = ("You are a teaching assistant grading discussion board posts. "
+                         "Grade based on quality, relevance, and critical thinking.")
+
+# Response Parsing Configuration
+PARSE_RETRIES = 2  # Re-asks per post whose answer contains no readable grade
+PARSE_RETRY_BUDGET = 200  # Re-asks allowed per grading run, so a misbehaving model cannot double the bill
 
 # Output Directory
-OUTPUT_DIR = "Canvas_Discussion_Exports"
\ No newline at end of file
+OUTPUT_DIR = "Canvas_Discussion_Exports"
+
+# Concurrency Configuration
+MAX_CONCURRENT_REQUESTS = 8
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+# Canvas Client Configuration
+CANVAS_MAX_WORKERS = 8
+CANVAS_TIMEOUT = 30
+CANVAS_RATE_LIMIT_THRESHOLD = 200
+CANVAS_MAX_THROTTLE_DELAY = 5.0
+CANVAS_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Grade Cache Configuration
+GRADE_CACHE_PATH = os.path.join(OUTPUT_DIR, "grade_cache.sqlite3")
+GRADE_CACHE_MAX_ENTRIES = 50000
+
+# Canvas Response Cache Configuration
+CANVAS_CACHE_TTL = 300
+CANVAS_CACHE_DIR = None  # e.g. os.path.join(OUTPUT_DIR, "canvas_cache") to persist across restarts
+CANVAS_CACHE_MAX_ENTRIES = 64  # Responses (e.g. whole /view payloads) kept in memory
+PARSED_DATA_CACHE_SIZE = 16
+
+# Batch Grading Configuration
+BATCH_STATE_DIR = os.path.join(OUTPUT_DIR, "batch_jobs")
+BATCH_POLL_INTERVAL = 30
+BATCH_MAX_REQUESTS = 50000
+BATCH_COMPLETION_WINDOW = "24h"
+
+# Packed Grading Configuration
+PACK_TOKEN_BUDGET = 3000
+PACK_MAX_POSTS = 20
+
+# Grade Journal Configuration
+JOURNAL_DIR = os.path.join(OUTPUT_DIR, "journal")
+
+# Message Preprocessing Configuration
+MESSAGE_TOKEN_BUDGET = 1500
+PREPROCESS_CACHE_SIZE = 10000
+
+# Gradebook Configuration
+GRADEBOOK_MAX_POSTS = 1  # Posts counted per student per topic (highest grades first)
+GRADEBOOK_MAX_REPLIES = 2  # Replies counted per student per topic
+GRADEBOOK_BEST_N = None  # Count only each student's best N topics (None = all topics)
+GRADEBOOK_ASSIGNMENT_NAME = "Discussion Participation"
+
+# Grade Push-back Configuration
+CANVAS_GRADE_CHUNK_SIZE = 100  # Students per bulk update_grades request
+CANVAS_PUSH_RETRIES = 3  # Retries of a failed chunk
+CANVAS_PROGRESS_POLL_INTERVAL = 2  # Seconds between Progress checks
+CANVAS_PROGRESS_TIMEOUT = 300  # Seconds to wait for one chunk to be applied
+
+# Duplicate Detection Configuration
+DEDUP_THRESHOLD = 0.85  # Estimated Jaccard similarity for a near-duplicate
+DEDUP_NUM_PERM = 64  # MinHash signature length
+DEDUP_BANDS = 16  # LSH bands (DEDUP_NUM_PERM must be divisible by this)
+DEDUP_SHINGLE_SIZE = 5  # Characters per shingle
@@ -1,6 +1,86 @@
 import pandas as pd
 import logging
-from typing import Tuple, Dict, List
+import threading
+from collections import OrderedDict
+from typing import Tuple, Dict, Iterable, List, Optional
+
+from src.config import PARSED_DATA_CACHE_SIZE
+
+# Parsed DataFrames keyed on the hash of the raw /view payload they came from
+_parsed_cache: "OrderedDict[str, Tuple[pd.DataFrame, pd.DataFrame]]" = OrderedDict()
+_parsed_cache_lock = threading.Lock()
+
+POST_COLUMNS = ['post_id', 'user_id', 'parent_id', 'thread_root_id', 'depth',
+                'created_at', 'updated_at', 'message', 'type', 'is_new']
+
+class _PostColumns:
+    """Column-wise accumulator for flattened discussion entries"""
+    def __init__(self):
+        self.columns: Dict[str, List] = {name: [] for name in POST_COLUMNS}
+        # entry id -> (depth, thread root id), including deleted entries, for placing new_entries
+        self.positions: Dict[int, Tuple[int, int]] = {}
+
+    def add_thread(self, root: Dict, parent: Optional[Tuple[int, int, int]] = None, is_new: bool = False):
+        """Walk one entry and all of its nested replies with an explicit stack (pre-order).
+
+        `parent` is (parent_id, parent_depth, thread_root_id) when root is itself a reply.
+        """
+        if parent is None:
+            stack = [(root, root.get('parent_id'), 0, root['id'])]
+        else:
+            parent_id, parent_depth, thread_root_id = parent
+            stack = [(root, parent_id, parent_depth + 1, thread_root_id)]
+
+        columns = self.columns
+        while stack:
+            entry, parent_id, depth, thread_root_id = stack.pop()
+            entry_id = entry['id']
+            if entry_id in self.positions:
+                continue
+            self.positions[entry_id] = (depth, thread_root_id)
+
+            # Deleted entries keep their place in the tree but carry no author or message
+            if not entry.get('deleted') and 'user_id' in entry:
+                columns['post_id'].append(entry_id)
+                columns['user_id'].append(entry['user_id'])
+                columns['parent_id'].append(entry.get('parent_id', parent_id))
+                columns['thread_root_id'].append(thread_root_id)
+                columns['depth'].append(depth)
+                columns['created_at'].append(entry.get('created_at'))
+                columns['updated_at'].append(entry.get('updated_at'))
+                columns['message'].append(entry.get('message') or "")
+                columns['type'].append('post' if depth == 0 else 'reply')
+                columns['is_new'].append(is_new)
+
+            for reply in reversed(entry.get('replies') or []):
+                stack.append((reply, entry_id, depth + 1, thread_root_id))
+
+    def add_new_entries(self, new_entries: Iterable[Dict]):
+        """Attach entries Canvas reports separately as new since the view was cached"""
+        for entry in sorted(new_entries, key=lambda e: e.get('created_at') or ""):
+            parent_id = entry.get('parent_id')
+            if parent_id is None:
+                self.add_thread(entry, is_new=True)
+            else:
+                depth, thread_root_id = self.positions.get(parent_id, (0, parent_id))
+                self.add_thread(entry, (parent_id, depth, thread_root_id), is_new=True)
+
+    def to_frame(self) -> pd.DataFrame:
+        columns = self.columns
+        return pd.DataFrame({
+            'post_id': pd.array(columns['post_id'], dtype='int64'),
+            'user_id': pd.array(columns['user_id'], dtype='int64'),
+            'parent_id': pd.array(columns['parent_id'], dtype='Int64'),
+            'thread_root_id': pd.array(columns['thread_root_id'], dtype='int64'),
+            'depth': pd.array(columns['depth'], dtype='int16'),
+            'created_at': pd.to_datetime(pd.Series(columns['created_at'], dtype=object),
+                                         utc=True, errors='coerce'),
+            'updated_at': pd.to_datetime(pd.Series(columns['updated_at'], dtype=object),
+                                         utc=True, errors='coerce'),
+            'message': pd.Series(columns['message'], dtype=object),
+            'type': pd.Categorical(columns['type'], categories=['post', 'reply']),
+            'is_new': pd.array(columns['is_new'], dtype=bool)
+        })
 
 class DiscussionDataProcessor:
     @staticmethod
@@ -8,49 +88,62 @@ class DiscussionDataProcessor:
         """Process raw discussion data into structured DataFrames"""
         participants = data.get('participants', [])
         view = data.get('view', [])
-        
+
         df_participants = pd.DataFrame(participants)
-        posts = DiscussionDataProcessor._extract_posts_and_replies(view)
-        df_posts = pd.DataFrame(posts)
-        
+        df_posts = DiscussionDataProcessor._flatten_view(view, data.get('new_entries') or [])
+
         return DiscussionDataProcessor._merge_participant_data(df_participants, df_posts)
-    
+
     @staticmethod
-    def _extract_posts_and_replies(view: List[Dict]) -> List[Dict]:
-        """Extract posts and replies from view data"""
-        posts = []
-        for post in view:
-            if 'user_id' in post:
-                posts.append(DiscussionDataProcessor._create_post_dict(post, 'post'))
-            
-            for reply in post.get('replies', []):
-                if 'user_id' in reply:
-                    posts.append(DiscussionDataProcessor._create_post_dict(reply, 'reply'))
-        return posts
-    
+    def process_discussion_stream(items: Iterable[Tuple[str, object]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Process (key, element) pairs from CanvasAPI.stream_discussion_data one thread at a time"""
+        columns = _PostColumns()
+        participants, new_entries = [], []
+        for key, value in items:
+            if key == 'view':
+                columns.add_thread(value)
+            elif key == 'participants':
+                participants.append(value)
+            elif key == 'new_entries':
+                new_entries.append(value)
+        columns.add_new_entries(new_entries)
+
+        return DiscussionDataProcessor._merge_participant_data(
+            pd.DataFrame(participants), columns.to_frame())
+
+    @staticmethod
+    def process_discussion_data_cached(data: Dict, payload_hash: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Memoized process_discussion_data; returns copies so callers may modify them"""
+        with _parsed_cache_lock:
+            cached = _parsed_cache.get(payload_hash)
+            if cached is not None:
+                _parsed_cache.move_to_end(payload_hash)
+        if cached is None:
+            cached = DiscussionDataProcessor.process_discussion_data(data)
+            with _parsed_cache_lock:
+                _parsed_cache[payload_hash] = cached
+                while len(_parsed_cache) > PARSED_DATA_CACHE_SIZE:
+                    _parsed_cache.popitem(last=False)
+        df_participants, df_posts = cached
+        return df_participants.copy(), df_posts.copy()
+
     @staticmethod
-    def _create_post_dict(post: Dict, post_type: str) -> Dict:
-        """Create standardized post dictionary"""
-        return {
-            'post_id': post['id'],
-            'user_id': post['user_id'],
-            'parent_id': post.get('parent_id'),
-            'created_at': post['created_at'],
-            'updated_at': post['updated_at'],
-            'message': post['message'],
-            'type': post_type
-        }
-    
+    def _flatten_view(view: List[Dict], new_entries: List[Dict]) -> pd.DataFrame:
+        """Flatten the threaded view at every depth into typed columns"""
+        columns = _PostColumns()
+        for thread in view:
+            columns.add_thread(thread)
+        columns.add_new_entries(new_entries)
+        return columns.to_frame()
+
     @staticmethod
-    def _merge_participant_data(df_participants: pd.DataFrame, 
+    def _merge_participant_data(df_participants: pd.DataFrame,
                               df_posts: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """Merge participant data with posts"""
         if not df_posts.empty and not df_participants.empty:
-            df_posts = df_posts.merge(
-                df_participants[['id', 'display_name']], 
-                left_on='user_id', 
-                right_on='id', 
-                how='left'
-            )
-            df_posts.drop('id', axis=1, inplace=True)
-        return df_participants, df_posts 
\ No newline at end of file
+            display_names = (df_participants[['id', 'display_name']]
+                             .drop_duplicates('id')
+                             .astype({'id': 'int64'})
+                             .set_index('id')['display_name'])
+            df_posts['display_name'] = df_posts['user_id'].map(display_names)
+        return df_participants, df_posts
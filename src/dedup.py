@@ -0,0 +1,137 @@
+import hashlib
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.config import DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_BANDS, DEDUP_SHINGLE_SIZE
+from src.text_preprocessor import grading_text_column
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+DUPLICATE_COLUMNS = ['duplicate_of', 'duplicate_cluster', 'cluster_size', 'similarity', 'flag_review']
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial edits hash the same"""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", (text or "").lower())).strip()
+
+
+def duplicate_followers(df_posts: pd.DataFrame) -> Dict[object, List[object]]:
+    """Map each representative's row index to the row indexes of its duplicates in df_posts"""
+    if 'duplicate_of' not in df_posts.columns:
+        return {}
+    index_by_post = dict(zip(df_posts['post_id'], df_posts.index))
+    followers: Dict[object, List[object]] = {}
+    for idx, representative in df_posts['duplicate_of'].dropna().items():
+        # A representative missing from df_posts (e.g. graded in an earlier run) leaves its duplicates to grade themselves
+        if representative in index_by_post:
+            followers.setdefault(index_by_post[representative], []).append(idx)
+    return followers
+
+
+def _hash32(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class DuplicateDetector:
+    """Groups exact and near-duplicate messages with normalized hashing and MinHash/LSH.
+
+    Clusters form greedily in row order: the first message of a cluster is its
+    representative, and a later message joins only if its estimated similarity to
+    that representative reaches the threshold, so members never drift by chaining.
+    """
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = DEDUP_NUM_PERM,
+                 bands: int = DEDUP_BANDS, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a*h + b stays below 2**64 with 32-bit shingle hashes and 31-bit coefficients
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, normalized: str) -> np.ndarray:
+        """MinHash signature of a normalized text's character shingles"""
+        k = self.shingle_size
+        shingles = {normalized[i:i + k] for i in range(max(len(normalized) - k + 1, 1))}
+        hashes = np.fromiter((_hash32(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME).min(axis=0)
+
+    def cluster(self, texts: List[str], groups: Optional[List] = None) -> List[Tuple[int, float]]:
+        """Return (representative position, similarity) for each text.
+
+        Texts only cluster with others of the same group (e.g. post type, so
+        members share max_points).
+        """
+        groups = groups if groups is not None else [None] * len(texts)
+        exact: Dict[Tuple, int] = {}
+        buckets: Dict[Tuple, List[int]] = {}
+        signatures = np.zeros((len(texts), self.num_perm), dtype=np.uint64)
+        assignments = []
+        for position, (text, group) in enumerate(zip(texts, groups)):
+            normalized = normalize_text(text)
+            exact_key = (group, hashlib.sha1(normalized.encode("utf-8")).digest())
+            if exact_key in exact:
+                assignments.append((exact[exact_key], 1.0))
+                continue
+
+            signature = self.signature(normalized)
+            band_keys = [(group, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                         for band in range(self.bands)]
+            candidates = list({rep for key in band_keys for rep in buckets.get(key, ())})
+            best, best_similarity = None, 0.0
+            if candidates:
+                similarities = (signatures[candidates] == signature).mean(axis=1)
+                best_index = int(similarities.argmax())
+                best, best_similarity = candidates[best_index], float(similarities[best_index])
+
+            if best is not None and best_similarity >= self.threshold:
+                exact[exact_key] = best
+                assignments.append((best, best_similarity))
+            else:
+                exact[exact_key] = position
+                signatures[position] = signature
+                for key in band_keys:
+                    buckets.setdefault(key, []).append(position)
+                assignments.append((position, 1.0))
+        return assignments
+
+    def annotate(self, df_posts: pd.DataFrame) -> pd.DataFrame:
+        """Add duplicate columns to a copy of df_posts.
+
+        duplicate_of is the representative's post_id (NA for representatives),
+        duplicate_cluster the representative's post_id for every member, and
+        flag_review marks clusters written by more than one student, a possible
+        sign of copying.
+        """
+        df_posts = df_posts.drop(columns=[c for c in DUPLICATE_COLUMNS if c in df_posts.columns])
+        if df_posts.empty:
+            return df_posts.assign(duplicate_of=pd.array([], dtype='Int64'),
+                                   duplicate_cluster=pd.array([], dtype='int64'),
+                                   cluster_size=pd.array([], dtype='int32'),
+                                   similarity=pd.array([], dtype='float64'),
+                                   flag_review=pd.array([], dtype=bool))
+
+        text_column = grading_text_column(df_posts)
+        assignments = self.cluster(df_posts[text_column].tolist(), df_posts['type'].astype(str).tolist())
+        post_ids = df_posts['post_id'].to_numpy()
+        rep_positions = np.array([rep for rep, _ in assignments])
+
+        df_posts = df_posts.copy()
+        df_posts['duplicate_cluster'] = pd.array(post_ids[rep_positions], dtype='int64')
+        is_member = rep_positions != np.arange(len(df_posts))
+        df_posts['duplicate_of'] = pd.array(np.where(is_member, post_ids[rep_positions], 0), dtype='Int64')
+        df_posts.loc[~is_member, 'duplicate_of'] = pd.NA
+        df_posts['similarity'] = [similarity for _, similarity in assignments]
+        clusters = df_posts.groupby('duplicate_cluster')
+        df_posts['cluster_size'] = clusters['post_id'].transform('size').astype('int32')
+        df_posts['flag_review'] = clusters['user_id'].transform('nunique').gt(1).to_numpy()
+        return df_posts
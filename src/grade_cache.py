@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from src.config import GRADE_CACHE_PATH, GRADE_CACHE_MAX_ENTRIES
+
+class GradeCache:
+    """SQLite-backed, size-bounded LRU cache of grades keyed by grading inputs"""
+    def __init__(self, path: str = GRADE_CACHE_PATH, max_entries: int = GRADE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS grades (
+                key TEXT PRIMARY KEY,
+                rubric_hash TEXT NOT NULL,
+                grade REAL NOT NULL,
+                feedback TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_grades_last_used ON grades (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_grades_rubric ON grades (rubric_hash)")
+        self._conn.commit()
+
+    @staticmethod
+    def rubric_hash(system_prompt: str) -> str:
+        return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(message: str, post_type: str, max_points: float,
+                 system_prompt: str, model: str, temperature: float) -> str:
+        """Content hash of everything that influences a grade"""
+        payload = json.dumps([message, post_type, float(max_points), system_prompt,
+                              model, float(temperature)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        """Return the cached (grade, feedback) for key, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT grade, feedback FROM grades WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE grades SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0], row[1]
+
+    def put(self, key: str, system_prompt: str, grade: float, feedback: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO grades (key, rubric_hash, grade, feedback, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, self.rubric_hash(system_prompt), float(grade), feedback, time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries beyond max_entries (caller holds the lock)"""
+        (size,) = self._conn.execute("SELECT COUNT(*) FROM grades").fetchone()
+        excess = size - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM grades WHERE key IN "
+                "(SELECT key FROM grades ORDER BY last_used ASC LIMIT ?)", (excess,))
+
+    def invalidate_rubric(self, system_prompt: str) -> int:
+        """Remove every grade produced under the given grading instructions"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM grades WHERE rubric_hash = ?", (self.rubric_hash(system_prompt),))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM grades")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM grades").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+import pandas as pd
+
+from src.config import JOURNAL_DIR
+
+class GradeJournal:
+    """Append-only JSONL journal of completed grades for one discussion identifier.
+
+    Every grade is flushed and fsynced as soon as it arrives, so a crash or
+    browser refresh loses at most the request in flight. Records carry a
+    settings key and the post's updated_at, so a later run only reuses grades
+    made under the same settings for unedited posts.
+    """
+    def __init__(self, identifier: str, directory: str = JOURNAL_DIR):
+        self.identifier = identifier
+        self.path = os.path.join(directory, f"{identifier}.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def settings_key(post_points: float, reply_points: float, system_prompt: str,
+                     model: str, temperature: float) -> str:
+        payload = json.dumps([float(post_points), float(reply_points), system_prompt,
+                              model, float(temperature)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def append(self, post_id, updated_at, settings: str, grade: float, feedback: str):
+        """Durably record one completed grade"""
+        record = json.dumps({
+            # numpy integers are not JSON serializable
+            'post_id': post_id.item() if hasattr(post_id, 'item') else post_id,
+            'updated_at': None if updated_at is None else str(updated_at),
+            'settings': settings,
+            'grade': grade,
+            'feedback': feedback
+        }, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(record + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load(self, settings: Optional[str] = None) -> Dict[str, Dict]:
+        """Return the latest record per post_id (as a string), optionally for one settings key"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash mid-write can leave a truncated final line
+                    logging.warning(f"Skipping unreadable line {line_number} of {self.path}")
+                    continue
+                if settings is None or record.get('settings') == settings:
+                    records[str(record['post_id'])] = record
+        return records
+
+    @staticmethod
+    def _is_current(record: Optional[Dict], row) -> bool:
+        if record is None:
+            return False
+        updated_at = row.get('updated_at')
+        return updated_at is None or record.get('updated_at') == str(updated_at)
+
+    def pending(self, df_posts: pd.DataFrame, settings: str) -> pd.DataFrame:
+        """Rows of df_posts without a current journaled grade under these settings"""
+        records = self.load(settings)
+        mask = [not self._is_current(records.get(str(row['post_id'])), row)
+                for _, row in df_posts.iterrows()]
+        return df_posts[mask]
+
+    def apply(self, df_posts: pd.DataFrame, settings: str) -> pd.DataFrame:
+        """Return a copy of df_posts with grade_numeric/grade_feedback assembled from the journal"""
+        records = self.load(settings)
+        graded = df_posts.copy()
+        grades, feedback = [], []
+        for _, row in graded.iterrows():
+            record = records.get(str(row['post_id']))
+            current = self._is_current(record, row)
+            grades.append(record['grade'] if current else None)
+            feedback.append(record['feedback'] if current else None)
+        graded['grade_numeric'] = grades
+        graded['grade_feedback'] = feedback
+        return graded
+
+    def discard(self, settings: str) -> int:
+        """Drop every record made under a settings key so those posts are graded again; returns the count"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            kept, removed = [], 0
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        matches = json.loads(line).get('settings') == settings
+                    except ValueError:
+                        matches = False
+                    if matches:
+                        removed += 1
+                    else:
+                        kept.append(line)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(kept)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
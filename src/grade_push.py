@@ -0,0 +1,124 @@
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import requests
+
+from src.config import (CANVAS_GRADE_CHUNK_SIZE, CANVAS_PUSH_RETRIES, CANVAS_PROGRESS_POLL_INTERVAL,
+                        CANVAS_PROGRESS_TIMEOUT)
+
+PENDING_STATES = {"queued", "running"}
+
+class GradePush:
+    """Pushes per-student scores and feedback comments to a Canvas assignment in bulk.
+
+    Only scores that differ from the current gradebook are sent, chunk_size
+    students per update_grades request. Each chunk's Progress is polled until
+    Canvas applies it, and failed chunks are retried.
+    """
+    def __init__(self, canvas_api,
+                 chunk_size: int = CANVAS_GRADE_CHUNK_SIZE,
+                 max_retries: int = CANVAS_PUSH_RETRIES,
+                 poll_interval: float = CANVAS_PROGRESS_POLL_INTERVAL,
+                 timeout: float = CANVAS_PROGRESS_TIMEOUT):
+        self.canvas_api = canvas_api
+        self.chunk_size = max(1, int(chunk_size))
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    @staticmethod
+    def build_comments(df_graded: pd.DataFrame) -> pd.Series:
+        """One feedback comment per student, listing the grade and feedback of each graded entry"""
+        df = df_graded[pd.to_numeric(df_graded['grade_numeric'], errors='coerce').notna()]
+        if df.empty:
+            return pd.Series(dtype=object)
+        lines = (df['type'].astype(str).str.capitalize() + " (" +
+                 pd.to_numeric(df['grade_numeric']).round(2).astype(str) + " pts): " +
+                 df['grade_feedback'].fillna("").astype(str))
+        return lines.groupby(df['user_id']).agg("\n".join)
+
+    def plan(self, course_id: int, assignment_id: int, scores: pd.DataFrame,
+             comments: Optional[pd.Series] = None, score_column: str = 'total') -> pd.DataFrame:
+        """Diff new scores against the current gradebook.
+
+        Returns one row per student with current_score, new_score, comment and a
+        `changed` flag; only changed rows are sent by push().
+        """
+        current = self.canvas_api.get_submission_scores(course_id, assignment_id)
+        diff = pd.DataFrame({
+            'user_id': scores['user_id'].astype('int64'),
+            'display_name': scores['display_name'] if 'display_name' in scores.columns else None,
+            'new_score': pd.to_numeric(scores[score_column]).round(2)
+        })
+        diff['current_score'] = pd.to_numeric(diff['user_id'].map(current), errors='coerce')
+        diff['changed'] = diff['current_score'].isna() | ((diff['new_score'] - diff['current_score']).abs() > 0.005)
+        unknown = ~diff['user_id'].isin(list(current))
+        if unknown.any():
+            logging.warning(f"{int(unknown.sum())} students have no submission on assignment {assignment_id} "
+                            f"and will be skipped")
+            diff.loc[unknown, 'changed'] = False
+        diff['comment'] = diff['user_id'].map(comments) if comments is not None else None
+        return diff
+
+    def push(self, course_id: int, assignment_id: int, plan: pd.DataFrame,
+             dry_run: bool = False) -> Dict[str, int]:
+        """Send the changed rows of a plan in chunks; returns counts of changed, sent and failed students"""
+        changes = plan[plan['changed']]
+        summary = {'students': len(plan), 'changed': len(changes), 'sent': 0, 'failed': 0}
+        if dry_run:
+            return summary
+
+        for start in range(0, len(changes), self.chunk_size):
+            chunk = changes.iloc[start:start + self.chunk_size]
+            grades = {int(user_id): (float(score), comment if isinstance(comment, str) else None)
+                      for user_id, score, comment in zip(chunk['user_id'], chunk['new_score'], chunk['comment'])}
+            if self._push_chunk(course_id, assignment_id, grades):
+                summary['sent'] += len(grades)
+            else:
+                summary['failed'] += len(grades)
+        return summary
+
+    def _push_chunk(self, course_id: int, assignment_id: int,
+                    grades: Dict[int, Tuple[float, Optional[str]]]) -> bool:
+        progress = None
+        pending = grades
+        for attempt in range(self.max_retries + 1):
+            try:
+                if progress is None:
+                    if attempt > 0:
+                        # A failed update may have been partly applied: only resend students
+                        # whose score is still not the new one, so no comment is posted twice
+                        pending = self._still_pending(course_id, assignment_id, pending)
+                        if not pending:
+                            return True
+                    progress = self.canvas_api.update_grades(course_id, assignment_id, pending)
+                # On timeout the update is still queued in Canvas, so keep polling the same Progress
+                progress = self.wait_for_progress(progress)
+                if progress.get('workflow_state') == "completed":
+                    return True
+                logging.error(f"Grade update for {len(pending)} students failed: {progress.get('message')}")
+                progress = None
+            except (requests.exceptions.RequestException, TimeoutError) as e:
+                logging.error(f"Grade update for {len(pending)} students failed: {e}")
+            if attempt < self.max_retries:
+                time.sleep(self.poll_interval * (2 ** attempt))
+        return False
+
+    def _still_pending(self, course_id: int, assignment_id: int,
+                       grades: Dict[int, Tuple[float, Optional[str]]]) -> Dict[int, Tuple[float, Optional[str]]]:
+        """Grades whose student's current Canvas score still differs from the new score"""
+        current = self.canvas_api.get_submission_scores(course_id, assignment_id)
+        return {user_id: (score, comment) for user_id, (score, comment) in grades.items()
+                if current.get(user_id) is None or abs(float(current[user_id]) - score) > 0.005}
+
+    def wait_for_progress(self, progress: Dict) -> Dict:
+        """Poll a Progress object until it leaves the queued/running states"""
+        started = time.monotonic()
+        while progress.get('workflow_state') in PENDING_STATES:
+            if time.monotonic() - started > self.timeout:
+                raise TimeoutError(f"Canvas progress {progress.get('id')} did not finish in {self.timeout}s")
+            time.sleep(self.poll_interval)
+            progress = self.canvas_api.get_progress(progress['id'])
+        return progress
@@ -0,0 +1,95 @@
+import csv
+import io
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.config import (GRADEBOOK_MAX_POSTS, GRADEBOOK_MAX_REPLIES, GRADEBOOK_BEST_N,
+                        GRADEBOOK_ASSIGNMENT_NAME)
+
+CANVAS_IMPORT_COLUMNS = ["Student", "ID", "SIS User ID", "SIS Login ID", "Section"]
+
+class Gradebook:
+    @staticmethod
+    def combine_topics(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """Stack graded topic DataFrames into one, tagging each row with its topic identifier"""
+        if not frames:
+            return pd.DataFrame(columns=['topic', 'user_id', 'type', 'grade_numeric'])
+        return pd.concat([df.assign(topic=identifier) for identifier, df in frames.items()],
+                         ignore_index=True)
+
+    @staticmethod
+    def aggregate(df_graded: pd.DataFrame,
+                  max_posts: Optional[int] = GRADEBOOK_MAX_POSTS,
+                  max_replies: Optional[int] = GRADEBOOK_MAX_REPLIES,
+                  best_n: Optional[int] = GRADEBOOK_BEST_N,
+                  max_total: Optional[float] = None) -> pd.DataFrame:
+        """Per-student totals: one column per topic plus a total.
+
+        Within each topic only a student's best `max_posts` posts and `max_replies`
+        replies count (None = no cap); `best_n` keeps each student's best N topic
+        scores in the total, and `max_total` caps the total.
+        """
+        df = df_graded.assign(grade=pd.to_numeric(df_graded['grade_numeric'], errors='coerce'))
+        df = df[df['grade'].notna()]
+        if 'topic' not in df.columns:
+            df = df.assign(topic="grade")
+        if df.empty:
+            return pd.DataFrame(columns=['user_id', 'display_name', 'total'])
+
+        # Rank each student's posts and replies per topic by grade, best first, and apply the caps
+        df = df.sort_values('grade', ascending=False, kind='stable')
+        rank = df.groupby(['topic', 'user_id', 'type'], observed=True, sort=False).cumcount()
+        caps = df['type'].astype(str).map({'post': max_posts, 'reply': max_replies}).astype(float)
+        df = df[rank < caps.fillna(np.inf)]
+
+        scores = (df.groupby(['user_id', 'topic'], observed=True)['grade'].sum()
+                  .unstack('topic', fill_value=0.0))
+        scores.columns = [str(topic) for topic in scores.columns]
+        if best_n:
+            topic_rank = scores.rank(axis=1, method='first', ascending=False)
+            total = scores.where(topic_rank <= best_n, 0.0).sum(axis=1)
+        else:
+            total = scores.sum(axis=1)
+        if max_total is not None:
+            total = total.clip(upper=max_total)
+
+        gradebook = scores.assign(total=total).reset_index()
+        if 'display_name' in df_graded.columns:
+            names = (df_graded.dropna(subset=['display_name'])
+                     .drop_duplicates('user_id', keep='last')
+                     .set_index('user_id')['display_name'])
+            gradebook.insert(1, 'display_name', gradebook['user_id'].map(names))
+        else:
+            gradebook.insert(1, 'display_name', None)
+        return gradebook.sort_values(['display_name', 'user_id'], na_position='last',
+                                     ignore_index=True)
+
+    @staticmethod
+    def to_canvas_csv(gradebook: pd.DataFrame,
+                      assignment_name: str = GRADEBOOK_ASSIGNMENT_NAME,
+                      assignment_id: Optional[int] = None,
+                      points_possible: Optional[float] = None,
+                      score_column: str = 'total') -> str:
+        """Render a CSV that Canvas's gradebook import accepts, matching students by Canvas ID"""
+        header = f"{assignment_name} ({assignment_id})" if assignment_id else assignment_name
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(CANVAS_IMPORT_COLUMNS + [header])
+        if points_possible is not None:
+            writer.writerow(["    Points Possible", "", "", "", "", points_possible])
+        for name, user_id, score in zip(gradebook['display_name'], gradebook['user_id'],
+                                        gradebook[score_column]):
+            writer.writerow([name if isinstance(name, str) else "", user_id, "", "", "",
+                             round(float(score), 2)])
+        return output.getvalue()
+
+    @staticmethod
+    def to_parquet(gradebook: pd.DataFrame, path: str):
+        """Save for fast reloads (requires pyarrow or fastparquet)"""
+        gradebook.to_parquet(path, index=False)
+
+    @staticmethod
+    def read_parquet(path: str) -> pd.DataFrame:
+        return pd.read_parquet(path)
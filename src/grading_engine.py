@@ -0,0 +1,268 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import openai
+import pandas as pd
+
+from src.config import (MAX_CONCURRENT_REQUESTS, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                        MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                        PACK_TOKEN_BUDGET, PACK_MAX_POSTS)
+from src.text_preprocessor import grading_text_column
+from src.dedup import duplicate_followers
+
+
+class GradeResult(NamedTuple):
+    index: object
+    grade: Optional[float]
+    feedback: Optional[str]
+    error: Optional[str]
+    cached: bool = False
+    deduplicated: bool = False
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills continuously at a per-minute rate"""
+    def __init__(self, per_minute: Optional[float]):
+        self.enabled = bool(per_minute)
+        self.capacity = float(per_minute or 0)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        """Block until `amount` tokens are available, then consume them"""
+        if not self.enabled:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Request and token budgets shared by all grading workers"""
+    def __init__(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float]):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, estimated_tokens: int):
+        self.requests.acquire(1)
+        self.tokens.acquire(estimated_tokens)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token estimate (about four characters per token)"""
+    return sum(len(text or "") for text in texts) // 4 + 1
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and connection problems are worth retrying"""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None,
+                  base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY) -> float:
+    """Exponential backoff with full jitter, honouring Retry-After when the server sends one"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), max_delay)
+            except ValueError:
+                pass
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def pack_posts(posts: List[Tuple[object, str, str]],
+               token_budget: int = PACK_TOKEN_BUDGET,
+               max_posts: int = PACK_MAX_POSTS) -> Tuple[List[List[Tuple[object, str, str]]], List[Tuple[object, str, str]]]:
+    """Greedily group (idx, message, post_type) items of the same type into packs under a token budget.
+
+    Returns (packs, singles); posts too large to share a request are returned as singles.
+    """
+    packs, singles = [], []
+    by_type: Dict[str, List[Tuple[object, str, str]]] = {}
+    for item in posts:
+        by_type.setdefault(item[2], []).append(item)
+    for items in by_type.values():
+        current, current_tokens = [], 0
+        for item in items:
+            tokens = estimate_tokens(item[1])
+            if tokens * 2 > token_budget:
+                singles.append(item)
+                continue
+            if current and (current_tokens + tokens > token_budget or len(current) >= max_posts):
+                packs.append(current)
+                current, current_tokens = [], 0
+            current.append(item)
+            current_tokens += tokens
+        if len(current) > 1:
+            packs.append(current)
+        else:
+            singles.extend(current)
+    return packs, singles
+
+
+class GradingEngine:
+    """Grades many posts concurrently through a GradingService"""
+    def __init__(self,
+                 grading_service,
+                 max_workers: int = MAX_CONCURRENT_REQUESTS,
+                 requests_per_minute: Optional[float] = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: Optional[float] = TOKENS_PER_MINUTE,
+                 max_retries: int = MAX_RETRIES,
+                 packed: bool = False,
+                 pack_token_budget: int = PACK_TOKEN_BUDGET,
+                 pack_max_posts: int = PACK_MAX_POSTS):
+        self.grading_service = grading_service
+        self.max_workers = max(1, int(max_workers))
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.packed = packed
+        self.pack_token_budget = pack_token_budget
+        self.pack_max_posts = pack_max_posts
+
+    def grade_posts(self,
+                    df_posts: pd.DataFrame,
+                    post_points: float,
+                    reply_points: float,
+                    system_prompt: str) -> Iterator[GradeResult]:
+        """Grade every row of df_posts, yielding results in completion order.
+
+        Rows are graded on clean_message when the preprocessing stage has added it.
+        When DuplicateDetector.annotate has added duplicate_of, only one representative
+        per cluster is graded and its result is fanned out to the other members.
+        """
+        followers = duplicate_followers(df_posts)
+        if not followers:
+            yield from self._grade_rows(df_posts, post_points, reply_points, system_prompt)
+            return
+
+        unique = df_posts.drop(index=[idx for members in followers.values() for idx in members])
+        for result in self._grade_rows(unique, post_points, reply_points, system_prompt):
+            yield result
+            for idx in followers.get(result.index, ()):
+                yield result._replace(index=idx, deduplicated=True)
+
+    def _grade_rows(self,
+                    df_posts: pd.DataFrame,
+                    post_points: float,
+                    reply_points: float,
+                    system_prompt: str) -> Iterator[GradeResult]:
+        """Grade each row on its own, answering cache hits first"""
+        # Cache hits are answered immediately and never consume rate-limit budget
+        text_column = grading_text_column(df_posts)
+        pending = []
+        for idx, row in df_posts.iterrows():
+            cached = self.grading_service.cached_grade(
+                row[text_column], row['type'], post_points, reply_points, system_prompt)
+            if cached is not None:
+                yield GradeResult(idx, cached[0], cached[1], None, cached=True)
+            else:
+                pending.append((idx, row[text_column], row['type']))
+        if not pending:
+            return
+
+        if self.packed:
+            packs, singles = pack_posts(pending, self.pack_token_budget, self.pack_max_posts)
+        else:
+            packs, singles = [], pending
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+
+            def submit_single(item):
+                idx, message, post_type = item
+                future = executor.submit(self._grade_single, message, post_type,
+                                         post_points, reply_points, system_prompt, time.monotonic())
+                futures[future] = ('single', item)
+
+            for pack in packs:
+                future = executor.submit(self._grade_pack, pack,
+                                         post_points, reply_points, system_prompt, time.monotonic())
+                futures[future] = ('pack', pack)
+            for item in singles:
+                submit_single(item)
+
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        kind, payload = futures.pop(future)
+                        if kind == 'single':
+                            try:
+                                grade, feedback = future.result()
+                                yield GradeResult(payload[0], grade, feedback, None)
+                            except Exception as e:
+                                yield GradeResult(payload[0], None, None, str(e))
+                            continue
+
+                        try:
+                            grades = future.result()
+                        except Exception as e:
+                            logging.warning(f"Packed grading request failed ({e}); grading individually")
+                            grades = {}
+                        # Posts missing from the packed answer are retried on their own
+                        for item in payload:
+                            if item[0] in grades:
+                                grade, feedback = grades[item[0]]
+                                yield GradeResult(item[0], grade, feedback, None)
+                            else:
+                                submit_single(item)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def grade_dataframe(self,
+                        df_posts: pd.DataFrame,
+                        post_points: float,
+                        reply_points: float,
+                        system_prompt: str) -> pd.DataFrame:
+        """Grade df_posts and return a copy with grade_numeric/grade_feedback filled in"""
+        graded_posts = df_posts.copy()
+        graded_posts['grade_numeric'] = None
+        graded_posts['grade_feedback'] = None
+        for result in self.grade_posts(df_posts, post_points, reply_points, system_prompt):
+            if result.error is None:
+                graded_posts.at[result.index, 'grade_numeric'] = result.grade
+                graded_posts.at[result.index, 'grade_feedback'] = result.feedback
+        return graded_posts
+
+    def _call_context(self, submitted_at: Optional[float]) -> Dict:
+        """Per-request context: each model call the request makes acquires from the shared
+        rate limiter and retries rate limits and server errors on its own"""
+        queue_wait = time.monotonic() - submitted_at if submitted_at is not None else 0.0
+        return {'queue_wait': queue_wait, 'rate_limiter': self.rate_limiter, 'max_retries': self.max_retries}
+
+    def _grade_single(self, message: str, post_type: str, post_points: float,
+                      reply_points: float, system_prompt: str, submitted_at: Optional[float] = None):
+        """Grade one post"""
+        return self.grading_service.request_grade(
+            message, post_type, post_points, reply_points, system_prompt, self._call_context(submitted_at))
+
+    def _grade_pack(self, pack: List[Tuple[object, str, str]], post_points: float,
+                    reply_points: float, system_prompt: str,
+                    submitted_at: Optional[float] = None) -> Dict[object, Tuple[float, str]]:
+        """Grade a pack of same-type posts in one request; returns grades keyed by index"""
+        ids = {str(n + 1): item[0] for n, item in enumerate(pack)}
+        messages = {str(n + 1): item[1] for n, item in enumerate(pack)}
+        grades = self.grading_service.request_packed_grades(
+            messages, pack[0][2], post_points, reply_points, system_prompt, self._call_context(submitted_at))
+        return {ids[post_id]: grade for post_id, grade in grades.items()}
@@ -1,13 +1,140 @@
-from openai import OpenAI
 import pandas as pd
+import json
+import logging
+import math
 import re
-from typing import Tuple
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from src.config import PARSE_RETRIES, PARSE_RETRY_BUDGET
+from src.grade_cache import GradeCache
+from src.grading_engine import backoff_delay, estimate_tokens, is_retryable
+from src.model_backend import ModelBackend, ModelRouter
+from src.telemetry import Telemetry, estimate_cost
+
+# Structured-output schemas, sent to backends with json_mode enabled
+GRADE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "grade",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"grade": {"type": "number"}, "feedback": {"type": "string"}},
+            "required": ["grade", "feedback"],
+            "additionalProperties": False
+        }
+    }
+}
+PACKED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "packed_grades",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"grades": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"id": {"type": "string"}, "grade": {"type": "number"},
+                               "feedback": {"type": "string"}},
+                "required": ["id", "grade", "feedback"],
+                "additionalProperties": False
+            }}},
+            "required": ["grades"],
+            "additionalProperties": False
+        }
+    }
+}
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+# A signed grade, so out-of-range answers like "-3;Off topic" are read and clamped rather than re-asked
+_GRADE_NUMBER = r"(-?\d+(?:\.\d+)?)"
+_OUT_OF = r"(?:\s*(?:/|out of)\s*\d+(?:\.\d+)?)?"
+# "8.5;Good work" at the start of a line, e.g. after a preamble line
+_GRADE_SEMICOLON = re.compile(r"^[\s*]*" + _GRADE_NUMBER + _OUT_OF + r"[\s*]*;(.*)", re.MULTILINE | re.DOTALL)
+# Explicitly labelled: "Grade: 8", "**Score:** 8/10; Good work"
+_GRADE_LABEL = re.compile(r"\b(?:grade|score)\b[\s*]*[:=][\s*]*" + _GRADE_NUMBER + _OUT_OF + r"[\s*]*(?:;(.*))?",
+                          re.IGNORECASE | re.DOTALL)
+# A bare "8/10" or "8 out of 10" opening the answer
+_GRADE_FRACTION = re.compile(r"\A[\s*]*" + _GRADE_NUMBER + r"\s*(?:/|out of)\s*\d+(?:\.\d+)?")
+
+
+class GradeParseError(ValueError):
+    """The model's answers contained no readable grade, even after re-asking"""
+
 
 class GradingService:
-    def __init__(self, api_key: str, model: str, temperature: float):
-        self.client = OpenAI(api_key=api_key)
-        self.model = model
+    def __init__(self, api_key: str, model: str, temperature: float,
+                 cache: Optional[GradeCache] = None, base_url: Optional[str] = None,
+                 telemetry: Optional[Telemetry] = None, router: Optional[ModelRouter] = None,
+                 parse_retries: int = PARSE_RETRIES, parse_retry_budget: int = PARSE_RETRY_BUDGET):
+        # Retries happen per call in _ask, with GradingEngine's rate limiter and jittered backoff
+        self.router = router if router is not None else ModelRouter(ModelBackend(model, api_key, base_url))
+        self.client = self.router.strong.client
+        self.model = self.router.strong.model
         self.temperature = temperature
+        self.cache = cache
+        self.telemetry = telemetry
+        self.parse_retries = parse_retries
+        self.parse_retry_budget = parse_retry_budget
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+    
+    @property
+    def model_label(self) -> str:
+        """Model or routing configuration, for keying journals and caches"""
+        return self.router.label
+    
+    def reset_stats(self):
+        """Start a new run: zero the counters and refill the re-ask budget"""
+        with self._stats_lock:
+            self.stats = {'fast_requests': 0, 'strong_requests': 0, 'escalations': 0,
+                          'responses': 0, 'unparsed': 0, 'reasks': 0, 'parse_failures': 0, 'clamped': 0}
+    
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+    
+    def _take_reask(self) -> bool:
+        with self._stats_lock:
+            if self.stats['reasks'] >= self.parse_retry_budget:
+                return False
+            self.stats['reasks'] += 1
+            return True
+    
+    def parse_report(self) -> Dict[str, float]:
+        """Counters since reset_stats plus parse_failure_rate, the share of model answers without a readable grade"""
+        with self._stats_lock:
+            report = dict(self.stats)
+        report['parse_failure_rate'] = report['unparsed'] / report['responses'] if report['responses'] else 0.0
+        return report
+    
+    def _cache_key(self, message: str, post_type: str, max_points: float, system_prompt: str,
+                   backend: ModelBackend) -> str:
+        return GradeCache.make_key(message, post_type, max_points, system_prompt,
+                                   backend.model, self.temperature)
+    
+    def cached_grade(self,
+                     message: str,
+                     post_type: str,
+                     post_points: float,
+                     reply_points: float,
+                     system_prompt: str) -> Optional[Tuple[float, str]]:
+        """Return a previously stored grade for identical inputs, if any.
+
+        Grades are stored under the backend that produced them, so a post routed
+        to the fast model also reuses a strong-model grade (escalated or batched).
+        """
+        if self.cache is None:
+            return None
+        max_points = post_points if post_type == 'post' else reply_points
+        backend = self.router.route(message)
+        candidates = [backend] if backend is self.router.strong else [backend, self.router.strong]
+        for candidate in candidates:
+            cached = self.cache.get(self._cache_key(message, post_type, max_points, system_prompt, candidate))
+            if cached is not None:
+                return cached
+        return None
     
     def grade_discussion(self, 
                         message: str, 
@@ -16,35 +143,261 @@ class GradingService:
                         reply_points: float,
                         system_prompt: str) -> Tuple[float, str]:
         """Grade a single discussion post/reply"""
+        cached = self.cached_grade(message, post_type, post_points, reply_points, system_prompt)
+        if cached is not None:
+            return cached
+        return self.request_grade(message, post_type, post_points, reply_points, system_prompt)
+    
+    def request_grade(self,
+                      message: str,
+                      post_type: str,
+                      post_points: float,
+                      reply_points: float,
+                      system_prompt: str,
+                      call_context: Optional[Dict] = None) -> Tuple[float, str]:
+        """Ask the model for a grade, bypassing cache lookup but storing the result.
+
+        An answer without a readable grade is escalated to the strong model, then
+        re-asked up to parse_retries times while the run's re-ask budget lasts.
+        Raises GradeParseError if no grade can be read, rather than scoring zero.
+        """
         max_points = post_points if post_type == 'post' else reply_points
         
-        response = self.client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": f"{system_prompt}\n\nIMPORTANT GRADING RULES:\n1. Always provide grades as whole numbers or decimals (not fractions)\n2. Grades must be between 0 and {max_points}\n3. Your response must strictly follow this format: [NUMBER];[EXPLANATION]\n4. Be objective and consistent in grading"},
-                {"role": "user", "content": self._create_grading_prompt(
-                    message, post_type, max_points)}
-            ],
-            temperature=self.temperature,
-            model=self.model
-        )
+        backend = self.router.route(message)
+        messages = self._create_messages(message, post_type, max_points, system_prompt, backend.json_mode)
+        content = self._ask(backend, messages, call_context, GRADE_RESPONSE_FORMAT)
+        parsed = self.read_grade(content, max_points)
+        escalation = self.router.escalation_for(backend)
+        if parsed is None and escalation is not None:
+            # The fast model did not follow the format; ask the strong model instead
+            self._count('escalations')
+            backend = escalation
+            messages = self._create_messages(message, post_type, max_points, system_prompt, backend.json_mode)
+            content = self._ask(backend, messages, call_context, GRADE_RESPONSE_FORMAT)
+            parsed = self.read_grade(content, max_points)
+        
+        retries = 0
+        while parsed is None and retries < self.parse_retries and self._take_reask():
+            retries += 1
+            reask = messages + [{"role": "assistant", "content": content or ""},
+                                {"role": "user", "content": self._create_reask_prompt(backend.json_mode)}]
+            content = self._ask(backend, reask, call_context, GRADE_RESPONSE_FORMAT)
+            parsed = self.read_grade(content, max_points)
         
-        return self._parse_grade_response(response.choices[0].message.content)
+        if parsed is None:
+            self._count('parse_failures')
+            raise GradeParseError(f"No grade found in the model's answer: {(content or '')[:200]!r}")
+        grade, feedback = parsed
+        self.store_grade(message, post_type, max_points, system_prompt, grade, feedback, backend)
+        return grade, feedback
+    
+    def request_packed_grades(self,
+                              messages: Dict[str, str],
+                              post_type: str,
+                              post_points: float,
+                              reply_points: float,
+                              system_prompt: str,
+                              call_context: Optional[Dict] = None) -> Dict[str, Tuple[float, str]]:
+        """Grade several posts of one type in a single request.
+
+        `messages` maps a short id to each message. Only ids the model answered
+        with a valid grade are returned; callers grade the rest individually.
+        """
+        max_points = post_points if post_type == 'post' else reply_points
+        prompt = self._create_packed_messages(messages, post_type, max_points, system_prompt)
+        
+        backend = self.router.route(*messages.values())
+        grades = self._read_packed_grades(
+            self._ask(backend, prompt, call_context, PACKED_RESPONSE_FORMAT), messages.keys(), max_points)
+        escalation = self.router.escalation_for(backend)
+        if not grades and escalation is not None:
+            self._count('escalations')
+            backend = escalation
+            grades = self._read_packed_grades(
+                self._ask(backend, prompt, call_context, PACKED_RESPONSE_FORMAT), messages.keys(), max_points)
+        
+        for post_id, (grade, feedback) in grades.items():
+            self.store_grade(messages[post_id], post_type, max_points, system_prompt, grade, feedback, backend)
+        return grades
+    
+    def _ask(self, backend: ModelBackend, messages: List[Dict[str, str]],
+             call_context: Optional[Dict], response_format: Dict) -> Optional[str]:
+        """Make one model call and return the answer's content.
+
+        When call_context carries the engine's rate_limiter, every call (escalations
+        and re-asks included) takes its share of the request and token budgets, and
+        rate limits or server errors retry this call alone, up to max_retries times.
+        """
+        call_context = call_context if call_context is not None else {}
+        rate_limiter = call_context.get('rate_limiter')
+        estimated = estimate_tokens(*(m['content'] for m in messages))
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            if rate_limiter is not None:
+                rate_limiter.acquire(estimated)
+            # The caller's queue wait is counted against the request's first call only
+            queue_wait = call_context.pop('queue_wait', 0.0) + time.monotonic() - started
+            try:
+                response = self._complete(backend, messages, {'queue_wait': queue_wait, 'retries': attempt},
+                                          response_format)
+                return response.choices[0].message.content
+            except Exception as e:
+                if attempt >= call_context.get('max_retries', 0) or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt, e)
+                logging.warning(f"Model request failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+    
+    def read_grade(self, response: Optional[str], max_points: float) -> Optional[Tuple[float, str]]:
+        """Parse a single-post answer, clamping the grade to [0, max_points]; None if no grade is readable"""
+        self._count('responses')
+        parsed = self._try_parse_grade(response)
+        if parsed is None:
+            self._count('unparsed')
+            return None
+        return self._clamp(parsed[0], max_points), parsed[1]
+    
+    def _read_packed_grades(self, response: Optional[str], expected_ids,
+                            max_points: float) -> Dict[str, Tuple[float, str]]:
+        self._count('responses')
+        grades = self._parse_packed_response(response, expected_ids)
+        if not grades:
+            self._count('unparsed')
+        return {post_id: (self._clamp(grade, max_points), feedback)
+                for post_id, (grade, feedback) in grades.items()}
+    
+    def _clamp(self, grade: float, max_points: float) -> float:
+        clamped = min(max(grade, 0.0), float(max_points))
+        if clamped != grade:
+            self._count('clamped')
+        return clamped
+    
+    def _complete(self, backend: ModelBackend, messages: List[Dict[str, str]],
+                  call_context: Optional[Dict] = None, response_format: Optional[Dict] = None):
+        """Call a backend, recording latency, token usage and cost when telemetry is enabled.
+
+        `call_context` carries queue_wait/retries measured by _ask.
+        """
+        self._count('fast_requests' if backend is self.router.fast else 'strong_requests')
+        if self.telemetry is None:
+            return backend.complete(messages, self.temperature, response_format)
+        
+        with self.telemetry.span('model', detail=backend.model, **(call_context or {})) as fields:
+            response = backend.complete(messages, self.temperature, response_format)
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                fields['prompt_tokens'] = usage.prompt_tokens or 0
+                fields['completion_tokens'] = usage.completion_tokens or 0
+                fields['cost'] = estimate_cost(backend.model, fields['prompt_tokens'],
+                                               fields['completion_tokens'])
+        return response
+    
+    def store_grade(self, message: str, post_type: str, max_points: float,
+                    system_prompt: str, grade: float, feedback: str,
+                    backend: Optional[ModelBackend] = None):
+        """Record a grade in the cache under the backend that produced it (the strong
+        model by default, e.g. for batch answers)"""
+        if self.cache is not None:
+            self.cache.put(self._cache_key(message, post_type, max_points, system_prompt,
+                                           backend or self.router.strong),
+                           system_prompt, grade, feedback)
     
     @staticmethod
-    def _create_grading_prompt(message: str, post_type: str, max_points: float) -> str:
+    def _create_messages(message: str, post_type: str, max_points: float,
+                         system_prompt: str, structured: bool = False) -> List[Dict[str, str]]:
+        response_rule = ("Your response must be a JSON object of the form {\"grade\": <number>, \"feedback\": \"<brief explanation>\"}"
+                         if structured else "Your response must strictly follow this format: [NUMBER];[EXPLANATION]")
+        return [
+            {"role": "system", "content": f"{system_prompt}\n\nIMPORTANT GRADING RULES:\n1. Always provide grades as whole numbers or decimals (not fractions)\n2. Grades must be between 0 and {max_points}\n3. {response_rule}\n4. Be objective and consistent in grading"},
+            {"role": "user", "content": GradingService._create_grading_prompt(
+                message, post_type, max_points, structured)}
+        ]
+    
+    @staticmethod
+    def _create_reask_prompt(structured: bool) -> str:
+        if structured:
+            return ("Your answer did not contain a readable grade. Reply with only the JSON object "
+                    "{\"grade\": <number>, \"feedback\": \"<brief explanation>\"}.")
+        return ("Your answer did not contain a readable grade. Reply with only [NUMBER];[EXPLANATION], "
+                "for example: 8.5;Clear argument supported by one source.")
+    
+    @staticmethod
+    def _create_packed_messages(messages: Dict[str, str], post_type: str, max_points: float,
+                                system_prompt: str) -> List[Dict[str, str]]:
+        entries = [{"id": post_id, "text": message} for post_id, message in messages.items()]
+        return [
+            {"role": "system", "content": f"{system_prompt}\n\nIMPORTANT GRADING RULES:\n1. Always provide grades as whole numbers or decimals (not fractions)\n2. Each grade must be between 0 and {max_points}\n3. Grade every {post_type} independently of the others\n4. Your response must be a JSON object of the form {{\"grades\": [{{\"id\": \"<id>\", \"grade\": <number>, \"feedback\": \"<brief explanation>\"}}]}} with exactly one entry per id\n5. Be objective and consistent in grading"},
+            {"role": "user", "content": f"Grade each of these {len(entries)} {post_type}s. Each is given as an id and its text.\n\n"
+                                        f"{json.dumps(entries, ensure_ascii=False, indent=1)}"}
+        ]
+    
+    @staticmethod
+    def _load_json_object(response: Optional[str]) -> Optional[Dict]:
+        """Decode a JSON object, also when the model wrapped it in prose or a code fence"""
+        text = (response or "").strip()
+        for candidate in (text, *(m.group(0) for m in [_JSON_OBJECT.search(text)] if m)):
+            try:
+                data = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                return data
+        return None
+    
+    @staticmethod
+    def _parse_packed_response(response: Optional[str], expected_ids) -> Dict[str, Tuple[float, str]]:
+        """Extract {id: (grade, feedback)} from a packed JSON response, skipping invalid entries"""
+        expected_ids = set(expected_ids)
+        data = GradingService._load_json_object(response)
+        entries = data.get("grades", []) if data is not None else []
+        grades = {}
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict) or str(entry.get("id")) not in expected_ids:
+                continue
+            try:
+                grade = float(entry["grade"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if math.isfinite(grade):
+                grades[str(entry["id"])] = (grade, str(entry.get("feedback", "")).strip())
+        return grades
+    
+    @staticmethod
+    def _create_grading_prompt(message: str, post_type: str, max_points: float,
+                               structured: bool = False) -> str:
+        answer = ("as a JSON object with the grade and a brief explanation as feedback" if structured
+                  else "followed by a semicolon and brief explanation")
         return (f"Grade this {post_type}. Provide a single number between 0 and {max_points} "
-                f"(use decimals, not fractions) followed by a semicolon and brief explanation.\n\n"
+                f"(use decimals, not fractions) {answer}.\n\n"
                 f"The {post_type} to grade: \"{message}\"")
     
     @staticmethod
-    def _parse_grade_response(response: str) -> Tuple[float, str]:
-        """Parse grading response into numeric grade and feedback"""
-        match = re.match(r"(\d+(?:\.\d+)?);(.*)", response.strip())
-        if match:
+    def _try_parse_grade(response: Optional[str]) -> Optional[Tuple[float, str]]:
+        """Read (grade, feedback) from a model answer, or None when it contains no grade.
+
+        Accepts a structured {"grade", "feedback"} object (bare, fenced or inside
+        prose), `[NUMBER];[EXPLANATION]` at the start of a line, and as a last resort
+        a labelled "Score: 8" or an opening "8/10". Numbers elsewhere in the prose
+        ("cites 3 out of 4 sources") are not grades, so such answers are re-asked.
+        """
+        text = (response or "").strip()
+        data = GradingService._load_json_object(text)
+        if data is not None and "grade" in data:
             try:
-                grade = float(match.group(1))
-                feedback = match.group(2).strip()
-                return grade, feedback
-            except ValueError:
-                return 0.0, "Error parsing grade value"
-        return 0.0, response 
\ No newline at end of file
+                grade = float(data["grade"])
+                if math.isfinite(grade):
+                    return grade, str(data.get("feedback", "")).strip()
+            except (TypeError, ValueError):
+                pass
+        match = _GRADE_SEMICOLON.search(text)
+        if match:
+            return float(match.group(1)), match.group(2).strip()
+        match = _GRADE_LABEL.search(text)
+        if match:
+            return float(match.group(1)), (match.group(2) or text).strip()
+        match = _GRADE_FRACTION.search(text)
+        if match:
+            return float(match.group(1)), text
+        return None 
\ No newline at end of file
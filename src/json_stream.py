@@ -0,0 +1,111 @@
+import codecs
+import json
+from typing import Iterable, Iterator, Tuple
+
+_NUMBER_DELIMITERS = frozenset(",]} \t\n\r")
+_WHITESPACE = " \t\n\r"
+
+
+class _ChunkBuffer:
+    """Text buffer fed incrementally from an iterable of byte chunks"""
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self, min_chars: int = 1) -> bool:
+        """Append at least min_chars more characters; False once the input is exhausted"""
+        wanted = len(self.text) + min_chars
+        while len(self.text) < wanted:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.text += self.decoder.decode(b"", final=True)
+                self.eof = True
+                return len(self.text) >= wanted
+            self.text += self.decoder.decode(chunk)
+        return True
+
+    def compact(self):
+        """Drop consumed text so memory stays bounded by the current element"""
+        # Only once half the buffer is consumed, so small elements do not copy it each time
+        if self.pos and self.pos * 2 >= len(self.text):
+            self.text = self.text[self.pos:]
+            self.pos = 0
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of input)"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            self.compact()
+            if not self.read_more():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of streamed JSON")
+        self.pos += 1
+
+    def decode_value(self, decoder: json.JSONDecoder):
+        """Decode one complete JSON value, reading more input until it is available"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+                # A number may continue in the next chunk ("2" + ".5", "2." + "5"), so it is
+                # complete only once a delimiter follows it
+                is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.eof or (end < len(self.text) and
+                                (not is_number or self.text[end] in _NUMBER_DELIMITERS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow geometrically so a large element is re-scanned only a few times
+            self.read_more(max(len(self.text) - self.pos, 1))
+
+
+def iter_object_items(chunks: Iterable[bytes]) -> Iterator[Tuple[str, object]]:
+    """Incrementally parse a top-level JSON object.
+
+    Yields (key, element) once per element of every array-valued key, and
+    (key, value) for other keys, holding only one element in memory at a time.
+    """
+    buffer = _ChunkBuffer(chunks)
+    decoder = json.JSONDecoder()
+
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        return
+    while True:
+        key = buffer.decode_value(decoder)
+        buffer.expect(":")
+        if buffer.peek() == "[":
+            buffer.pos += 1
+            if buffer.peek() == "]":
+                buffer.pos += 1
+            else:
+                while True:
+                    yield key, buffer.decode_value(decoder)
+                    buffer.compact()
+                    separator = buffer.peek()
+                    buffer.pos += 1
+                    if separator == "]":
+                        break
+                    if separator != ",":
+                        raise ValueError(f"Malformed array for key {key!r} in streamed JSON")
+        else:
+            yield key, buffer.decode_value(decoder)
+            buffer.compact()
+
+        separator = buffer.peek()
+        buffer.pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError("Malformed object in streamed JSON")
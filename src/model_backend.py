@@ -0,0 +1,62 @@
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+from src.config import ROUTING_TOKEN_THRESHOLD, ESCALATE_ON_PARSE_FAILURE
+from src.text_preprocessor import count_tokens
+
+class ModelBackend:
+    """One model on an OpenAI-compatible chat completions endpoint.
+
+    base_url selects the server: None for OpenAI itself, or e.g.
+    http://localhost:8080/v1 for a local llama.cpp, vLLM or Ollama server.
+    Set json_mode=False for servers without response_format support.
+    """
+    def __init__(self, model: str, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 json_mode: bool = True, timeout: Optional[float] = None):
+        # Local servers usually ignore the key, but the client requires one
+        self.client = OpenAI(api_key=api_key or "not-needed", base_url=base_url,
+                             max_retries=0, timeout=timeout)
+        self.model = model
+        self.base_url = base_url
+        self.json_mode = json_mode
+
+    def complete(self, messages: List[Dict[str, str]], temperature: float,
+                 response_format: Optional[Dict] = None):
+        """Create a chat completion; response_format is dropped when the server does not support it"""
+        kwargs = {'response_format': response_format} if response_format and self.json_mode else {}
+        return self.client.chat.completions.create(
+            messages=messages, temperature=temperature, model=self.model, **kwargs)
+
+
+class ModelRouter:
+    """Sends short posts to a fast, cheap backend and everything else to the strong one.
+
+    With escalate set, a fast-model answer that cannot be parsed is asked
+    again of the strong backend.
+    """
+    def __init__(self, strong: ModelBackend, fast: Optional[ModelBackend] = None,
+                 token_threshold: int = ROUTING_TOKEN_THRESHOLD,
+                 escalate: bool = ESCALATE_ON_PARSE_FAILURE):
+        self.strong = strong
+        self.fast = fast
+        self.token_threshold = token_threshold
+        self.escalate = escalate
+
+    def route(self, *messages: str) -> ModelBackend:
+        """Backend for a post, or for a pack of posts judged by its longest message"""
+        if self.fast is None:
+            return self.strong
+        longest = max((count_tokens(message or "") for message in messages), default=0)
+        return self.fast if longest <= self.token_threshold else self.strong
+
+    def escalation_for(self, backend: ModelBackend) -> Optional[ModelBackend]:
+        """Backend to retry with after `backend` produced an unparseable answer"""
+        return self.strong if self.escalate and backend is not self.strong else None
+
+    @property
+    def label(self) -> str:
+        """Describes the routing so grades from different configurations are not mixed up"""
+        if self.fast is None:
+            return self.strong.model
+        return f"{self.fast.model}<={self.token_threshold}|{self.strong.model}"
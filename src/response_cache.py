@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from src.config import CANVAS_CACHE_TTL, CANVAS_CACHE_MAX_ENTRIES
+
+class ResponseCache:
+    """Cache of Canvas GET responses with TTL and ETag/Last-Modified validators.
+
+    Entries are dicts with keys: data, next_url, etag, last_modified, payload_hash
+    and fetched_at. When a directory is given, entries are also persisted there
+    as JSON so they survive restarts. At most max_entries stay in memory, least
+    recently used first out; evicted entries are reloaded from the directory if any.
+    """
+    def __init__(self, ttl: float = CANVAS_CACHE_TTL, directory: Optional[str] = None,
+                 max_entries: int = CANVAS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(url: str, params: Optional[Dict] = None) -> str:
+        if not params:
+            return url
+        return url + "?" + "&".join(f"{k}={params[k]}" for k in sorted(params))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the stored entry for key (fresh or stale), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.directory:
+            path = self._path(key)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+                entry['fetched_at'] = os.path.getmtime(path)
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable cache entry for {key}: {e}")
+                return None
+            self._store(key, entry)
+        return entry
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def put(self, key: str, entry: Dict):
+        entry['fetched_at'] = time.time()
+        self._store(key, entry)
+        if self.directory:
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+
+    def _store(self, key: str, entry: Dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, key: str, entry: Dict):
+        """Mark a revalidated (304 Not Modified) entry as fresh again without rewriting it"""
+        entry['fetched_at'] = time.time()
+        if self.directory:
+            try:
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from src.config import MODEL_PRICING
+
+try:
+    from opentelemetry import trace as _otel_trace
+    _TRACER = _otel_trace.get_tracer("canvas-discussion-grader")
+except ImportError:  # OpenTelemetry is optional; spans are only emitted when it is installed
+    _TRACER = None
+
+RECORD_FIELDS = ['kind', 'started_at', 'wall_time', 'queue_wait', 'retries', 'prompt_tokens',
+                 'completion_tokens', 'cost', 'ok', 'detail']
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a model call from MODEL_PRICING (0 for unknown models)"""
+    prompt_price, completion_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Telemetry:
+    """Thread-safe recorder of per-call wall time, queue wait, retries, token usage and cost.
+
+    Records are grouped by kind ("canvas" for Canvas requests, "model" for model
+    calls) and summarized with latency percentiles and throughput.
+    """
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, wall_time: float, queue_wait: float = 0.0, retries: int = 0,
+               prompt_tokens: int = 0, completion_tokens: int = 0, cost: float = 0.0,
+               ok: bool = True, detail: str = "", started_at: Optional[float] = None):
+        record = {
+            'kind': kind,
+            'started_at': started_at if started_at is not None else time.time() - wall_time,
+            'wall_time': wall_time,
+            'queue_wait': queue_wait,
+            'retries': retries,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': cost,
+            'ok': ok,
+            'detail': detail
+        }
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def span(self, kind: str, **fields):
+        """Time a block and record it; the yielded dict may be updated with token counts etc.
+
+        Exceptions are recorded with ok=False and re-raised. An OpenTelemetry span
+        is emitted alongside when opentelemetry is installed.
+        """
+        started_at = time.time()
+        start = time.perf_counter()
+        fields.setdefault('ok', True)
+        otel_span = _TRACER.start_as_current_span(f"grader.{kind}") if _TRACER is not None else None
+        active = otel_span.__enter__() if otel_span is not None else None
+        try:
+            yield fields
+        except BaseException:
+            fields['ok'] = False
+            raise
+        finally:
+            wall_time = time.perf_counter() - start
+            self.record(kind, wall_time, started_at=started_at, **fields)
+            if active is not None:
+                for name, value in fields.items():
+                    active.set_attribute(f"grader.{name}", value)
+                otel_span.__exit__(None, None, None)
+
+    def _select(self, since: Optional[float]) -> List[Dict]:
+        with self._lock:
+            records = list(self.records)
+        if since is not None:
+            records = [r for r in records if r['started_at'] >= since]
+        return records
+
+    def summary(self, since: Optional[float] = None) -> Dict[str, Dict[str, float]]:
+        """Aggregate records per kind: counts, latency percentiles, throughput, tokens and cost"""
+        by_kind: Dict[str, List[Dict]] = {}
+        for record in self._select(since):
+            by_kind.setdefault(record['kind'], []).append(record)
+
+        summaries = {}
+        for kind, records in by_kind.items():
+            latencies = sorted(r['wall_time'] for r in records)
+            first = min(r['started_at'] for r in records)
+            last = max(r['started_at'] + r['wall_time'] for r in records)
+            elapsed = max(last - first, 1e-9)
+            summaries[kind] = {
+                'calls': len(records),
+                'errors': sum(not r['ok'] for r in records),
+                'retries': sum(r['retries'] for r in records),
+                'p50_latency': _percentile(latencies, 0.50),
+                'p95_latency': _percentile(latencies, 0.95),
+                'p99_latency': _percentile(latencies, 0.99),
+                'mean_queue_wait': sum(r['queue_wait'] for r in records) / len(records),
+                'throughput_per_sec': len(records) / elapsed,
+                'prompt_tokens': sum(r['prompt_tokens'] for r in records),
+                'completion_tokens': sum(r['completion_tokens'] for r in records),
+                'cost': sum(r['cost'] for r in records)
+            }
+        return summaries
+
+    def to_json(self, since: Optional[float] = None) -> str:
+        return json.dumps({'summary': self.summary(since), 'records': self._select(since)}, indent=2)
+
+    def to_csv(self, since: Optional[float] = None) -> str:
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=RECORD_FIELDS)
+        writer.writeheader()
+        writer.writerows(self._select(since))
+        return output.getvalue()
+
+    def to_prometheus(self) -> str:
+        """Render cumulative metrics in the Prometheus text exposition format"""
+        lines = [
+            "# TYPE grader_calls_total counter",
+            "# TYPE grader_errors_total counter",
+            "# TYPE grader_retries_total counter",
+            "# TYPE grader_tokens_total counter",
+            "# TYPE grader_cost_usd_total counter",
+            "# TYPE grader_latency_seconds summary"
+        ]
+        for kind, stats in sorted(self.summary().items()):
+            label = f'kind="{kind}"'
+            lines.append(f"grader_calls_total{{{label}}} {stats['calls']}")
+            lines.append(f"grader_errors_total{{{label}}} {stats['errors']}")
+            lines.append(f"grader_retries_total{{{label}}} {stats['retries']}")
+            lines.append(f'grader_tokens_total{{{label},type="prompt"}} {stats["prompt_tokens"]}')
+            lines.append(f'grader_tokens_total{{{label},type="completion"}} {stats["completion_tokens"]}')
+            lines.append(f"grader_cost_usd_total{{{label}}} {stats['cost']:.6f}")
+            for quantile in ("50", "95", "99"):
+                lines.append(f'grader_latency_seconds{{{label},quantile="0.{quantile}"}} '
+                             f"{stats[f'p{quantile}_latency']:.6f}")
+            lines.append(f"grader_latency_seconds_count{{{label}}} {stats['calls']}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Expose to_prometheus() at http://host:port/metrics from a background thread"""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = telemetry.to_prometheus().encode()
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,160 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Dict, Tuple
+
+import pandas as pd
+
+from src.config import MESSAGE_TOKEN_BUDGET, PREPROCESS_CACHE_SIZE
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional; fall back to a character-based estimate
+    _ENCODING = None
+
+_BLOCK_TAGS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'tr', 'table', 'blockquote', 'pre',
+               'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr'}
+_SKIP_TAGS = {'script', 'style', 'head', 'title', 'iframe', 'object', 'video', 'audio', 'svg'}
+_DATA_URI = re.compile(r"data:[\w/+.-]+;base64,[A-Za-z0-9+/=\s]+")
+_INLINE_SPACE = re.compile(r"[ \t\f\v\u00a0]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def grading_text_column(df_posts: pd.DataFrame) -> str:
+    """Column holding the text to grade: the preprocessed message when available"""
+    return 'clean_message' if 'clean_message' in df_posts.columns else 'message'
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, otherwise about four characters per token"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the readable text of a Canvas message"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+        self.attachment = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'img':
+            # Embedded images (often base64) carry no gradable text beyond their alt text
+            alt = (attrs.get('alt') or "").strip()
+            if alt and not self.skip_depth:
+                self.parts.append(f" [image: {alt}] ")
+        elif tag == 'a' and 'instructure_file_link' in (attrs.get('class') or ""):
+            self.attachment = []
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'a' and self.attachment is not None:
+            name = "".join(self.attachment).strip()
+            self.attachment = None
+            self.parts.append(f" [attachment: {name}] " if name else " [attachment] ")
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.attachment is not None:
+            self.attachment.append(data)
+        else:
+            self.parts.append(data)
+
+
+def html_to_text(message: str) -> str:
+    """Convert Canvas message HTML to plain text with collapsed whitespace"""
+    if not message:
+        return ""
+    message = _DATA_URI.sub("[embedded file]", message)
+    extractor = _TextExtractor()
+    extractor.feed(message)
+    extractor.close()
+    text = "".join(extractor.parts)
+    text = "\n".join(_INLINE_SPACE.sub(" ", line).strip() for line in text.splitlines())
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def truncate_to_budget(text: str, tokens: int, budget: int) -> str:
+    """Keep the beginning and end of an over-budget message, dropping the middle"""
+    chars_per_token = len(text) / max(tokens, 1)
+    keep = int(budget * chars_per_token)
+    head = text[:keep * 2 // 3]
+    tail = text[len(text) - keep // 3:]
+    return f"{head}\n[... {tokens - budget} tokens omitted ...]\n{tail}"
+
+
+class MessagePreprocessor:
+    """Cleans and budgets messages before grading, memoized by message hash"""
+    def __init__(self, token_budget: int = MESSAGE_TOKEN_BUDGET, cache_size: int = PREPROCESS_CACHE_SIZE):
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[str, int, int, bool]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'messages': 0, 'original_tokens': 0, 'cleaned_tokens': 0,
+                      'truncated': 0, 'cache_hits': 0}
+
+    def _process(self, message: str) -> Tuple[str, int, int, bool]:
+        text = html_to_text(message)
+        tokens = count_tokens(text)
+        truncated = tokens > self.token_budget
+        if truncated:
+            text = truncate_to_budget(text, tokens, self.token_budget)
+            tokens = count_tokens(text)
+        return text, count_tokens(message or ""), tokens, truncated
+
+    def preprocess(self, message: str) -> Tuple[str, int]:
+        """Return (clean_text, token_count) for one raw message"""
+        key = hashlib.sha1((message or "").encode("utf-8")).hexdigest()
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.stats['cache_hits'] += 1
+        if result is None:
+            result = self._process(message)
+            with self._lock:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        text, original_tokens, tokens, truncated = result
+        with self._lock:
+            self.stats['messages'] += 1
+            self.stats['original_tokens'] += original_tokens
+            self.stats['cleaned_tokens'] += tokens
+            self.stats['truncated'] += int(truncated)
+        return text, tokens
+
+    def preprocess_dataframe(self, df_posts: pd.DataFrame) -> pd.DataFrame:
+        """Add clean_message and message_tokens columns; the raw message column is kept for export"""
+        df_posts = df_posts.copy()
+        results = [self.preprocess(message) for message in df_posts['message']]
+        df_posts['clean_message'] = [text for text, _ in results]
+        df_posts['message_tokens'] = pd.array([tokens for _, tokens in results], dtype='int32')
+        return df_posts
+
+    def summary(self) -> Dict[str, float]:
+        """Per-run statistics including tokens saved"""
+        stats = dict(self.stats)
+        stats['tokens_saved'] = stats['original_tokens'] - stats['cleaned_tokens']
+        stats['percent_saved'] = (100.0 * stats['tokens_saved'] / stats['original_tokens']
+                                  if stats['original_tokens'] else 0.0)
+        return stats
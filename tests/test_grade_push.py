@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+from fakes.fake_canvas import FakeCanvasServer, generate_courses
+from src.canvas_api import CanvasAPI
+from src.grade_push import GradePush
+
+def _start(**kwargs):
+    courses = generate_courses(num_courses=1, topics_per_course=1, posts_per_topic=6, replies_per_post=0)
+    server = FakeCanvasServer(courses, **kwargs)
+    api = CanvasAPI(server.start(), "test-token")
+    assignment_id = next(iter(server.assignments))
+    return server, api, assignment_id
+
+
+def _course_id(server, assignment_id):
+    return server.assignments[assignment_id]['course_id']
+
+
+def _push(server, api, assignment_id, **kwargs):
+    user_ids = list(server.assignments[assignment_id]['scores'])
+    scores = pd.DataFrame({'user_id': user_ids, 'total': [float(i + 1) for i in range(len(user_ids))]})
+    comments = pd.Series({user_id: f"Feedback for {user_id}" for user_id in user_ids})
+    pusher = GradePush(api, poll_interval=0.01, **kwargs)
+    course_id = _course_id(server, assignment_id)
+    plan = pusher.plan(course_id, assignment_id, scores, comments)
+    return pusher.push(course_id, assignment_id, plan), scores
+
+
+def _update_requests(server, assignment_id):
+    return server.request_counts.get(
+        f"/courses/{_course_id(server, assignment_id)}/assignments/{assignment_id}/submissions/update_grades", 0)
+
+
+@pytest.fixture
+def failing_server():
+    server, api, assignment_id = _start(failed_updates=1)
+    yield server, api, assignment_id
+    api.close()
+    server.stop()
+
+
+def test_failed_chunk_is_retried(failing_server):
+    server, api, assignment_id = failing_server
+    summary, scores = _push(server, api, assignment_id)
+
+    assignment = server.assignments[assignment_id]
+    assert summary['sent'] == len(scores) and summary['failed'] == 0
+    assert _update_requests(server, assignment_id) == 2
+    assert all(len(comments) == 1 for comments in assignment['comments'].values())
+    assert [assignment['scores'][user_id] for user_id in scores['user_id']] == list(scores['total'])
+
+
+def test_partly_applied_failure_resends_only_remaining_students(failing_server):
+    server, api, assignment_id = failing_server
+    applied = next(iter(server.assignments[assignment_id]['scores']))
+    create_progress = server.create_progress
+
+    def apply_first_then_fail(progress_assignment_id, grade_data):
+        # Canvas can apply part of a bulk update before its Progress fails
+        if server.failed_updates and applied in grade_data:
+            assignment = server.assignments[progress_assignment_id]
+            assignment['scores'][applied] = float(grade_data[applied]['posted_grade'])
+            assignment['comments'][applied].append(grade_data[applied]['text_comment'])
+        return create_progress(progress_assignment_id, grade_data)
+
+    server.create_progress = apply_first_then_fail
+    summary, scores = _push(server, api, assignment_id)
+
+    assignment = server.assignments[assignment_id]
+    assert summary['sent'] == len(scores) and summary['failed'] == 0
+    assert all(len(comments) == 1 for comments in assignment['comments'].values())
+    assert [assignment['scores'][user_id] for user_id in scores['user_id']] == list(scores['total'])
+
+
+def test_timed_out_progress_is_polled_not_resent():
+    server, api, assignment_id = _start(progress_delay=0.3)
+    try:
+        summary, scores = _push(server, api, assignment_id, timeout=0.05, max_retries=10)
+        assignment = server.assignments[assignment_id]
+        assert summary['sent'] == len(scores) and summary['failed'] == 0
+        assert _update_requests(server, assignment_id) == 1
+        assert all(len(comments) == 1 for comments in assignment['comments'].values())
+    finally:
+        api.close()
+        server.stop()
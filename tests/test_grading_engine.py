@@ -0,0 +1,33 @@
+import pandas as pd
+
+from fakes.fake_openai import FakeOpenAIServer
+from src.grading_engine import GradingEngine
+from src.grading_service import GradingService
+
+COMPLETIONS = "/v1/chat/completions"
+
+
+def test_every_model_call_is_rate_limited_and_retried_on_its_own():
+    server = FakeOpenAIServer(rate_limit_rate=0.3, retry_after=0.001, malformed_rate=1.0)
+    base_url = server.start()
+    try:
+        service = GradingService("test-key", "gpt-4o-mini", 0.0, base_url=base_url,
+                                 parse_retries=2, parse_retry_budget=1000)
+        engine = GradingEngine(service, max_workers=4, requests_per_minute=1_000_000,
+                               tokens_per_minute=None, max_retries=20)
+        acquired = []
+        acquire = engine.rate_limiter.acquire
+        engine.rate_limiter.acquire = lambda tokens: acquired.append(tokens) or acquire(tokens)
+
+        df_posts = pd.DataFrame({'message': [f"Post number {n} about the reading" for n in range(20)],
+                                 'type': 'post'})
+        results = list(engine.grade_posts(df_posts, 10, 5, "Grade fairly."))
+
+        # No answer carries a grade, so each post gets its first answer plus two re-asks
+        assert all(result.error is not None for result in results)
+        answered = server.request_counts[COMPLETIONS] - server.request_counts.get('rate_limited', 0)
+        assert server.request_counts.get('rate_limited', 0) > 0
+        assert answered == 3 * len(df_posts)
+        assert len(acquired) == server.request_counts[COMPLETIONS]
+    finally:
+        server.stop()
@@ -0,0 +1,34 @@
+import json
+
+from src.json_stream import iter_object_items
+
+
+def _bytewise(payload: str):
+    data = payload.encode("utf-8")
+    return [data[i:i + 1] for i in range(len(data))]
+
+
+def test_numbers_split_across_chunks():
+    assert list(iter_object_items([b'{"a": 2.', b'5, "b": 3}'])) == [("a", 2.5), ("b", 3)]
+    assert list(iter_object_items([b'{"a": 1e', b'3, "b": -', b'4}'])) == [("a", 1000.0), ("b", -4)]
+
+
+def test_payload_fed_one_byte_at_a_time():
+    payload = {
+        "count": 12345,
+        "ratio": -0.125,
+        "big": 6.02e23,
+        "flag": True,
+        "none": None,
+        "name": "café ☃",
+        "items": [{"id": 1, "score": 9.75}, 17, 2.5e-3, "x", [1, 2]],
+        "empty": [],
+    }
+    expected = []
+    for key, value in payload.items():
+        if isinstance(value, list):
+            expected.extend((key, element) for element in value)
+        else:
+            expected.append((key, value))
+    assert list(iter_object_items(_bytewise(json.dumps(payload)))) == expected
+    assert list(iter_object_items(_bytewise(json.dumps(payload, indent=2)))) == expected